@@ -0,0 +1,218 @@
+"""Servidor HTTP que imita a API do Paperless-ngx para benchmarks.
+
+Aceita uploads em /api/documents/post_document/ e responde com o UUID da
+tarefa, que termina (SUCCESS) depois de --consume-delay segundos. Latência,
+erros 500 e 429 (com Retry-After) podem ser injetados. O instante em que
+cada arquivo foi recebido fica disponível em /_bench/acks.
+
+    python benchmarks/fake_paperless.py --port 8765 --latency 0.05 --error-rate 0.01
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FILENAME_RE = re.compile(rb'filename="([^"]*)"')
+
+
+class FakePaperless:
+    """Estado compartilhado entre as requisições"""
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0,
+                 throttle_rate=0.0, retry_after=1, consume_delay=0.0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.consume_delay = consume_delay
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.acks = {}  # nome do arquivo -> instante (time.time()) do 200
+        self.tasks = {}  # task_id -> {'created', 'filename', 'acknowledged'}
+        self.counters = {'requests': 0, 'uploads': 0, 'bytes': 0,
+                         'errors': 0, 'throttled': 0}
+
+    def roll(self):
+        """Sorteia o resultado do upload: 200, 500 ou 429"""
+        with self.lock:
+            value = self.random.random()
+        if value < self.error_rate:
+            return 500
+        if value < self.error_rate + self.throttle_rate:
+            return 429
+        return 200
+
+    def delay(self):
+        if self.latency or self.jitter:
+            with self.lock:
+                extra = self.random.uniform(0, self.jitter)
+            time.sleep(self.latency + extra)
+
+    def task_list(self):
+        now = time.time()
+        with self.lock:
+            tasks = list(self.tasks.items())
+        results = []
+        for number, (task_id, task) in enumerate(tasks, 1):
+            if task['acknowledged']:
+                continue
+            done = now - task['created'] >= self.consume_delay
+            results.append({
+                'id': number, 'task_id': task_id,
+                'task_file_name': task['filename'],
+                'status': 'SUCCESS' if done else 'STARTED',
+                'result': 'Success' if done else None,
+                'related_document': number if done else None,
+            })
+        return results
+
+
+def make_handler(state):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'  # keep-alive, como o Paperless real
+
+        def _send_json(self, status, payload, headers=None):
+            body = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _read_body(self):
+            remaining = int(self.headers.get('Content-Length') or 0)
+            head = b''
+            while remaining > 0:
+                chunk = self.rfile.read(min(remaining, 1024 * 1024))
+                if not chunk:
+                    break
+                if len(head) < 4096:
+                    head += chunk[:4096]
+                remaining -= len(chunk)
+            return head
+
+        def do_GET(self):
+            with state.lock:
+                state.counters['requests'] += 1
+            path, _, query = self.path.partition('?')
+            if path == '/api/':
+                self._send_json(200, {'documents': '/api/documents/'})
+            elif path == '/api/tasks/':
+                tasks = state.task_list()
+                match = re.search(r'task_id=([\w-]+)', query)
+                if match:
+                    tasks = [t for t in tasks if t['task_id'] == match.group(1)]
+                self._send_json(200, tasks)
+            elif path in ('/api/documents/', '/api/tags/',
+                          '/api/correspondents/', '/api/document_types/'):
+                self._send_json(200, {'count': 0, 'next': None, 'results': []})
+            elif path == '/_bench/acks':
+                with state.lock:
+                    payload = {'acks': dict(state.acks),
+                               'counters': dict(state.counters)}
+                self._send_json(200, payload)
+            else:
+                self._send_json(404, {'detail': 'Not found.'})
+
+        def do_POST(self):
+            with state.lock:
+                state.counters['requests'] += 1
+            path = self.path.split('?', 1)[0]
+            if path == '/api/documents/post_document/':
+                head = self._read_body()
+                state.delay()
+                status = state.roll()
+                if status == 500:
+                    with state.lock:
+                        state.counters['errors'] += 1
+                    self._send_json(500, {'detail': 'Erro injetado'})
+                    return
+                if status == 429:
+                    with state.lock:
+                        state.counters['throttled'] += 1
+                    self._send_json(429, {'detail': 'Throttled'},
+                                    {'Retry-After': str(state.retry_after)})
+                    return
+                match = FILENAME_RE.search(head)
+                filename = match.group(1).decode('utf-8', 'replace') if match else ''
+                task_id = str(uuid.uuid4())
+                with state.lock:
+                    state.acks[filename] = time.time()
+                    state.tasks[task_id] = {'created': time.time(),
+                                            'filename': filename,
+                                            'acknowledged': False}
+                    state.counters['uploads'] += 1
+                    state.counters['bytes'] += int(
+                        self.headers.get('Content-Length') or 0)
+                self._send_json(200, task_id)
+            elif path == '/api/acknowledge_tasks/':
+                length = int(self.headers.get('Content-Length') or 0)
+                ids = set(json.loads(self.rfile.read(length) or b'{}')
+                          .get('tasks', []))
+                with state.lock:
+                    for number, task in enumerate(state.tasks.values(), 1):
+                        if number in ids:
+                            task['acknowledged'] = True
+                self._send_json(200, {'result': len(ids)})
+            else:
+                self._read_body()
+                self._send_json(404, {'detail': 'Not found.'})
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def serve(port=0, bind='127.0.0.1', **options):
+    """Inicia o servidor numa thread; retorna (servidor, estado)"""
+    state = FakePaperless(**options)
+    server = ThreadingHTTPServer((bind, port), make_handler(state))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, state
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Paperless falso para benchmarks")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--bind', default='127.0.0.1')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help="atraso fixo por upload (segundos)")
+    parser.add_argument('--jitter', type=float, default=0.0,
+                        help="atraso extra aleatório de até N segundos")
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help="fração de uploads respondidos com HTTP 500")
+    parser.add_argument('--throttle-rate', type=float, default=0.0,
+                        help="fração de uploads respondidos com HTTP 429")
+    parser.add_argument('--retry-after', type=int, default=1)
+    parser.add_argument('--consume-delay', type=float, default=0.0,
+                        help="segundos até a tarefa de consumo terminar")
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args(argv)
+
+    server, _ = serve(args.port, args.bind, latency=args.latency,
+                      jitter=args.jitter, error_rate=args.error_rate,
+                      throttle_rate=args.throttle_rate,
+                      retry_after=args.retry_after,
+                      consume_delay=args.consume_delay, seed=args.seed)
+    print(f"Paperless falso em http://{args.bind}:{server.server_address[1]}",
+          flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
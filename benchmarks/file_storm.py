@@ -0,0 +1,85 @@
+"""Gerador de "tempestade" de arquivos para benchmarks.
+
+Cria milhares de arquivos de tamanhos variados (distribuição log-uniforme
+entre --min-size e --max-size) de uma vez (burst) ou a uma taxa fixa
+(trickle). Com a mesma --seed, o conteúdo e a ordem são reproduzíveis.
+Grava um manifesto JSON com o instante em que cada arquivo ficou completo.
+
+    python benchmarks/file_storm.py /tmp/pasta --count 2000 --mode trickle --rate 200
+"""
+import argparse
+import json
+import math
+import os
+import random
+import time
+
+EXTENSIONS = ('.pdf', '.jpg', '.png', '.tiff')
+
+
+def plan(count, min_size, max_size, seed=0, subfolders=0):
+    """Lista reproduzível de (caminho relativo, tamanho)"""
+    rng = random.Random(seed)
+    files = []
+    for i in range(count):
+        size = int(math.exp(rng.uniform(math.log(min_size), math.log(max_size))))
+        folder = f'lote{rng.randrange(subfolders):02d}' if subfolders else ''
+        name = f'doc_{seed}_{i:06d}{rng.choice(EXTENSIONS)}'
+        files.append((os.path.join(folder, name), size))
+    return files
+
+
+def write_file(path, size, rng, chunk_size=256 * 1024):
+    """Escreve em blocos (como um scanner/cópia faria); conteúdo único"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        remaining = size
+        while remaining > 0:
+            n = min(chunk_size, remaining)
+            f.write(rng.randbytes(n))
+            remaining -= n
+
+
+def storm(folder, files, mode='burst', rate=100.0, seed=0):
+    """Cria os arquivos; retorna {nome: instante em que ficou completo}"""
+    rng = random.Random(seed + 1)
+    written = {}
+    started = time.monotonic()
+    for i, (relative, size) in enumerate(files):
+        if mode == 'trickle':
+            # Ritmo fixo: o i-ésimo arquivo sai em started + i/rate
+            wait = started + i / rate - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+        write_file(os.path.join(folder, relative), size, rng)
+        written[os.path.basename(relative)] = time.time()
+    return written
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Gera uma tempestade de arquivos")
+    parser.add_argument('folder')
+    parser.add_argument('--count', type=int, default=1000)
+    parser.add_argument('--min-size', type=int, default=10 * 1024)
+    parser.add_argument('--max-size', type=int, default=2 * 1024 * 1024)
+    parser.add_argument('--mode', choices=('burst', 'trickle'), default='burst')
+    parser.add_argument('--rate', type=float, default=100.0,
+                        help="arquivos por segundo no modo trickle")
+    parser.add_argument('--subfolders', type=int, default=0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--manifest', help="grava os instantes de escrita em JSON")
+    args = parser.parse_args(argv)
+
+    files = plan(args.count, args.min_size, args.max_size, args.seed,
+                 args.subfolders)
+    written = storm(args.folder, files, args.mode, args.rate, args.seed)
+    total = sum(size for _, size in files)
+    print(f"{len(written)} arquivos, {total / 1048576:.1f} MB em {args.folder}")
+    if args.manifest:
+        with open(args.manifest, 'w', encoding='utf-8') as f:
+            json.dump(written, f)
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
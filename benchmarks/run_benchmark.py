@@ -0,0 +1,238 @@
+"""Benchmark do uploader contra o Paperless falso.
+
+Para cada modo (engine), sobe o servidor falso e o gerador de arquivos em
+processos separados e roda o uploader (observer + pool) num processo
+próprio, de modo que CPU e pico de memória medidos são só do uploader.
+Relata arquivos/s, latência p50/p99 da escrita do arquivo até o 200 do
+servidor, pico de RSS e tempo de CPU.
+
+    python benchmarks/run_benchmark.py --count 2000 --engines sequential,pooled,async
+    python benchmarks/run_benchmark.py --count 500 --max-p99 5 --min-throughput 50
+
+Com --max-p99/--min-throughput, sai com código 1 se algum modo piorar
+(uso em CI).
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from configparser import ConfigParser
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+# Configuração de cada modo, aplicada sobre a seção DEFAULT
+ENGINES = {
+    'sequential': {'upload_workers': '1', 'http_pool_size': '1'},
+    'pooled': {},  # upload_workers = --workers
+    'async': {'upload_engine': 'async'},  # requer aiohttp
+    'polling': {'observer': 'polling', 'poll_interval': '1'},
+}
+
+
+def percentile(values, q):
+    """Percentil pelo método nearest-rank (None se vazio)"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(q / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def resource_usage():
+    """(segundos de CPU, pico de RSS em MB) deste processo"""
+    try:
+        import resource
+    except ImportError:  # Windows
+        try:
+            import psutil
+        except ImportError:
+            times = os.times()
+            return times.user + times.system, None
+        process = psutil.Process()
+        cpu = process.cpu_times()
+        return cpu.user + cpu.system, process.memory_info().peak_wset / 1048576
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    # ru_maxrss: KB no Linux, bytes no macOS
+    scale = 1048576 if sys.platform == 'darwin' else 1024
+    return usage.ru_utime + usage.ru_stime, usage.ru_maxrss / scale
+
+
+def start_server(args):
+    """Sobe o Paperless falso em outro processo; retorna (processo, url)"""
+    command = [sys.executable, os.path.join(HERE, 'fake_paperless.py'),
+               '--port', '0', '--latency', str(args.latency),
+               '--jitter', str(args.jitter),
+               '--error-rate', str(args.error_rate),
+               '--throttle-rate', str(args.throttle_rate),
+               '--consume-delay', str(args.consume_delay),
+               '--seed', str(args.seed)]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    line = process.stdout.readline().strip()
+    return process, line.rsplit(' ', 1)[-1]
+
+
+def fetch_acks(url):
+    with urllib.request.urlopen(f'{url}/_bench/acks', timeout=10) as response:
+        return json.load(response)
+
+
+def run_engine(engine, args):
+    """Executa um modo (chamado no processo filho) e retorna o relatório"""
+    import paperless_monitor as pm
+
+    workdir = tempfile.mkdtemp(prefix=f'paperless_bench_{engine}_')
+    folder = os.path.join(workdir, 'entrada')
+    os.makedirs(folder)
+    manifest = os.path.join(workdir, 'manifest.json')
+
+    config = ConfigParser()
+    config['DEFAULT'] = {
+        'upload_workers': str(args.workers),
+        'log_file': os.path.join(workdir, 'bench.log'),
+        'log_console': 'false',
+        'retry_base_delay': '1',
+        'retry_max_delay': '5',
+        'task_poll_min_interval': '0.5',
+    }
+    config['DEFAULT'].update(ENGINES[engine])
+
+    server, url = start_server(args)
+    store = pm.StateStore(os.path.join(workdir, 'state.db'))
+    uploader = pm.PaperlessUploader(url, 'benchmark', folder,
+                                    settings=config['DEFAULT'], store=store)
+    observer = pm.create_observer(folder, config['DEFAULT'])
+    observer.schedule(uploader, folder, recursive=True)
+    observer.start()
+
+    cpu_before, _ = resource_usage()
+    storm = subprocess.Popen(
+        [sys.executable, os.path.join(HERE, 'file_storm.py'), folder,
+         '--count', str(args.count), '--min-size', str(args.min_size),
+         '--max-size', str(args.max_size), '--mode', args.mode,
+         '--rate', str(args.rate), '--subfolders', str(args.subfolders),
+         '--seed', str(args.seed), '--manifest', manifest],
+        stdout=subprocess.DEVNULL)
+
+    deadline = time.monotonic() + args.timeout
+    data = {'acks': {}, 'counters': {}}
+    while time.monotonic() < deadline:
+        time.sleep(0.25)
+        data = fetch_acks(url)
+        if storm.poll() is not None and len(data['acks']) >= args.count:
+            break
+    storm.wait()
+    cpu_after, peak_rss = resource_usage()
+
+    observer.stop()
+    observer.join(timeout=5)
+    uploader.shutdown(wait=True)
+    store.close()
+    server.terminate()
+    server.wait()
+
+    with open(manifest, encoding='utf-8') as f:
+        written = json.load(f)
+    acks = data['acks']
+    latencies = [acks[name] - written[name] for name in written if name in acks]
+    elapsed = (max(acks.values()) - min(written.values())) if acks else None
+    return {
+        'engine': engine,
+        'files': args.count,
+        'uploaded': len(latencies),
+        'seconds': elapsed,
+        'files_per_sec': len(latencies) / elapsed if elapsed else 0.0,
+        'latency_p50': percentile(latencies, 50),
+        'latency_p99': percentile(latencies, 99),
+        'peak_rss_mb': peak_rss,
+        'cpu_seconds': cpu_after - cpu_before,
+        'server': data['counters'],
+    }
+
+
+def print_report(results):
+    print(f"{'modo':<12} {'enviados':>9} {'arq/s':>8} {'p50 (s)':>8} "
+          f"{'p99 (s)':>8} {'RSS (MB)':>9} {'CPU (s)':>8}")
+    for r in results:
+        def fmt(value, spec):
+            return format(value, spec) if value is not None else '-'
+        print(f"{r['engine']:<12} {r['uploaded']:>5}/{r['files']:<4}"
+              f"{r['files_per_sec']:>8.1f} {fmt(r['latency_p50'], '8.3f')} "
+              f"{fmt(r['latency_p99'], '8.3f')} {fmt(r['peak_rss_mb'], '9.1f')} "
+              f"{r['cpu_seconds']:>8.2f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark do Paperless Auto Uploader")
+    parser.add_argument('--engines', default='sequential,pooled',
+                        help=f"modos separados por vírgula ({', '.join(ENGINES)})")
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--count', type=int, default=1000)
+    parser.add_argument('--min-size', type=int, default=10 * 1024)
+    parser.add_argument('--max-size', type=int, default=2 * 1024 * 1024)
+    parser.add_argument('--mode', choices=('burst', 'trickle'), default='burst')
+    parser.add_argument('--rate', type=float, default=100.0)
+    parser.add_argument('--subfolders', type=int, default=0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--latency', type=float, default=0.02)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--throttle-rate', type=float, default=0.0)
+    parser.add_argument('--consume-delay', type=float, default=0.0)
+    parser.add_argument('--timeout', type=float, default=600.0)
+    parser.add_argument('--output', help="grava o relatório em JSON")
+    parser.add_argument('--max-p99', type=float,
+                        help="falha se a latência p99 passar deste valor (s)")
+    parser.add_argument('--min-throughput', type=float,
+                        help="falha se arquivos/s ficar abaixo deste valor")
+    parser.add_argument('--single', help=argparse.SUPPRESS)
+    parser.add_argument('--result-file', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.single:
+        # Processo filho: um modo por processo, medições isoladas
+        result = run_engine(args.single, args)
+        with open(args.result_file, 'w', encoding='utf-8') as f:
+            json.dump(result, f)
+        return 0
+
+    results = []
+    for engine in [e.strip() for e in args.engines.split(',') if e.strip()]:
+        if engine not in ENGINES:
+            parser.error(f"modo desconhecido: {engine}")
+        with tempfile.TemporaryDirectory() as tmp:
+            result_file = os.path.join(tmp, 'result.json')
+            child_argv = [a for a in (argv if argv is not None else sys.argv[1:])]
+            subprocess.run([sys.executable, os.path.abspath(__file__),
+                            *child_argv, '--single', engine,
+                            '--result-file', result_file], check=True)
+            with open(result_file, encoding='utf-8') as f:
+                results.append(json.load(f))
+
+    print_report(results)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+    failed = False
+    for r in results:
+        if r['uploaded'] < r['files']:
+            print(f"❌ {r['engine']}: {r['files'] - r['uploaded']} arquivo(s) não enviados")
+            failed = True
+        if args.max_p99 is not None and (r['latency_p99'] or 0) > args.max_p99:
+            print(f"❌ {r['engine']}: p99 {r['latency_p99']:.3f}s > {args.max_p99}s")
+            failed = True
+        if args.min_throughput is not None and \
+                r['files_per_sec'] < args.min_throughput:
+            print(f"❌ {r['engine']}: {r['files_per_sec']:.1f} arq/s < "
+                  f"{args.min_throughput}")
+            failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
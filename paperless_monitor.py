@@ -1,235 +1,3988 @@
 import time
 import requests
+from requests.adapters import HTTPAdapter
 import os
 import json
+import re
+import fnmatch
+import hashlib
 import logging
+import logging.handlers
+import atexit
+import sqlite3
+import shutil
+import tempfile
+import zipfile
+import importlib.util
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from watchdog.observers import Observer
-from watchdog.events import FileSystemEventHandler
-from datetime import datetime
-import tkinter as tk
-from tkinter import filedialog, messagebox, ttk
+from watchdog.events import (FileSystemEventHandler, FileCreatedEvent,
+                             FileDeletedEvent, FileModifiedEvent,
+                             FileMovedEvent)
+from datetime import datetime, timedelta
 import threading
+import asyncio
+import queue
+import heapq
+import bisect
+import itertools
+from collections import deque, defaultdict, namedtuple
+import random
+import uuid
+from email.utils import parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from configparser import ConfigParser
 import sys
-import pystray
-from PIL import Image, ImageDraw
+import argparse
+import signal
+import multiprocessing
+
+# Dependências da interface gráfica: importadas sob demanda para que o modo
+# headless (servidores sem display) não pague o custo de tkinter/pystray/PIL
+tk = filedialog = messagebox = ttk = None
+pystray = Image = ImageDraw = None
+aiohttp = None
+
+
+def _load_gui_modules():
+    """Importa tkinter apenas quando a interface gráfica é usada"""
+    global tk, filedialog, messagebox, ttk
+    import tkinter as tk
+    from tkinter import filedialog, messagebox, ttk
+
+
+def _load_tray_modules():
+    """Importa pystray e Pillow apenas quando o ícone da bandeja é criado"""
+    global pystray, Image, ImageDraw
+    import pystray
+    from PIL import Image, ImageDraw
+
+
+def _load_async_modules():
+    """Importa aiohttp apenas quando o engine async é usado"""
+    global aiohttp
+    import aiohttp
+
+
+def app_data_path(filename):
+    """Caminho de um arquivo de dados ao lado do script"""
+    return os.path.join(os.path.dirname(__file__), filename)
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """Uma linha JSON por registro; os campos estáveis estão sempre presentes
+    (null quando não se aplicam) para facilitar envio e consulta"""
+
+    FIELDS = ('route', 'path', 'size', 'duration', 'status', 'task_id')
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(
+                timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        fields = getattr(record, 'fields', None) or {}
+        for key in self.FIELDS:
+            entry[key] = fields.get(key)
+        entry.update((key, value) for key, value in fields.items()
+                     if key not in entry)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+_log_listener = None
+_log_lock = threading.Lock()
+
+
+def setup_logging(settings):
+    """Configura o logging uma única vez por processo.
+
+    As threads só colocam o registro numa fila (QueueHandler); a formatação
+    e a escrita em disco, com rotação, ficam com a thread do QueueListener.
+    """
+    global _log_listener
+    with _log_lock:
+        if _log_listener is not None:
+            return _log_listener
+
+        log_file = settings.get('log_file', '').strip() or \
+            app_data_path('paperless_uploader.log')
+        when = settings.get('log_rotate_when', '').strip()
+        backups = settings.getint('log_backup_count', fallback=5)
+        if when:
+            file_handler = logging.handlers.TimedRotatingFileHandler(
+                log_file, when=when, backupCount=backups, encoding='utf-8')
+        else:
+            file_handler = logging.handlers.RotatingFileHandler(
+                log_file, encoding='utf-8', backupCount=backups,
+                maxBytes=settings.getint('log_max_bytes',
+                                         fallback=10 * 1024 * 1024))
+        if settings.get('log_format', 'text').strip().lower() == 'json':
+            file_handler.setFormatter(JsonLinesFormatter())
+        else:
+            file_handler.setFormatter(logging.Formatter(
+                '%(asctime)s - %(levelname)s - %(message)s'))
+        handlers = [file_handler]
+        if settings.getboolean('log_console', fallback=True):
+            console_handler = logging.StreamHandler()
+            console_handler.setFormatter(logging.Formatter(
+                '%(asctime)s - %(levelname)s - %(message)s'))
+            handlers.append(console_handler)
+
+        log_queue = queue.SimpleQueue()
+        root = logging.getLogger()
+        root.setLevel(logging.INFO)
+        root.addHandler(logging.handlers.QueueHandler(log_queue))
+        _log_listener = logging.handlers.QueueListener(log_queue, *handlers)
+        _log_listener.start()
+        # Esvazia a fila antes de o processo terminar
+        atexit.register(shutdown_logging)
+        return _log_listener
+
+
+def shutdown_logging():
+    """Grava os registros pendentes e encerra a thread do QueueListener"""
+    global _log_listener
+    with _log_lock:
+        listener, _log_listener = _log_listener, None
+    if listener is not None:
+        listener.stop()
+        for handler in listener.handlers:
+            handler.close()
+
+
+def file_checksum(file_path, chunk_size=1024 * 1024):
+    """Calcula o MD5 do arquivo em blocos (mesmo checksum usado pelo Paperless)"""
+    digest = hashlib.md5()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class StateStore:
+    """Estado persistente dos arquivos (SQLite em modo WAL), consultado sob demanda"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS files (
+            path TEXT PRIMARY KEY,
+            state TEXT NOT NULL,
+            size INTEGER,
+            mtime_ns INTEGER,
+            checksum TEXT,
+            archived_path TEXT,
+            error TEXT,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL,
+            task_id TEXT,
+            document_id INTEGER,
+            archived_at REAL,
+            updated_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS files_checksum ON files (checksum);
+        CREATE INDEX IF NOT EXISTS files_state ON files (state);
+        CREATE INDEX IF NOT EXISTS files_retry
+            ON files (state, next_attempt_at);
+        CREATE INDEX IF NOT EXISTS files_archived ON files (archived_at);
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+    """
+
+    # Colunas adicionadas depois da primeira versão do banco
+    UPGRADE_COLUMNS = {
+        'attempts': 'INTEGER NOT NULL DEFAULT 0',
+        'next_attempt_at': 'REAL',
+        'task_id': 'TEXT',
+        'document_id': 'INTEGER',
+        'archived_at': 'REAL',
+    }
+
+    # Estados que contam como "já enviado" para a deduplicação; 'consuming'
+    # é um arquivo enviado aguardando o Paperless concluir o consumo.
+    # 'unconfirmed' (consumo sem resposta até task_timeout) fica de fora:
+    # o arquivo continua na pasta e volta na próxima varredura
+    DONE_STATES = ('done', 'duplicate', 'consuming')
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(
+            db_path, check_same_thread=False, isolation_level=None, timeout=30)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self._upgrade()
+        self.conn.executescript(self.SCHEMA)
+
+    def _upgrade(self):
+        """Adiciona colunas novas a bancos criados por versões anteriores"""
+        existing = {row['name'] for row in
+                    self.conn.execute('PRAGMA table_info(files)')}
+        if not existing:
+            return  # Banco novo: o SCHEMA cria tudo
+        for column, definition in self.UPGRADE_COLUMNS.items():
+            if column not in existing:
+                self.conn.execute(
+                    f'ALTER TABLE files ADD COLUMN {column} {definition}')
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    def get(self, file_path):
+        rows = self._execute('SELECT * FROM files WHERE path = ?', (file_path,))
+        return rows[0] if rows else None
+
+    def set_state(self, file_path, state, **fields):
+        """Cria ou atualiza o registro do arquivo com o novo estado"""
+        fields['state'] = state
+        fields['updated_at'] = time.time()
+        columns = ', '.join(fields)
+        placeholders = ', '.join('?' for _ in fields)
+        updates = ', '.join(f'{column} = excluded.{column}' for column in fields)
+        self._execute(
+            f'INSERT INTO files (path, {columns}) VALUES (?, {placeholders}) '
+            f'ON CONFLICT(path) DO UPDATE SET {updates}',
+            (file_path, *fields.values()))
+
+    def cached_checksum(self, file_path, size, mtime_ns):
+        """Checksum já conhecido se o arquivo não mudou desde o último hash"""
+        row = self.get(file_path)
+        if row and row['checksum'] and row['size'] == size \
+                and row['mtime_ns'] == mtime_ns:
+            return row['checksum']
+        return None
+
+    def checksum_for(self, file_path, size, mtime_ns):
+        """Retorna o checksum do arquivo, calculando apenas se necessário"""
+        checksum = self.cached_checksum(file_path, size, mtime_ns)
+        if checksum is None:
+            checksum = file_checksum(file_path)
+            self._execute(
+                'INSERT INTO files (path, state, size, mtime_ns, checksum, '
+                'updated_at) VALUES (?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT(path) DO UPDATE SET size = excluded.size, '
+                'mtime_ns = excluded.mtime_ns, checksum = excluded.checksum',
+                (file_path, 'pending', size, mtime_ns, checksum, time.time()))
+        return checksum
+
+    def update(self, file_path, **fields):
+        """Atualiza campos de um registro existente sem mudar o estado"""
+        assignments = ', '.join(f'{column} = ?' for column in fields)
+        self._execute(
+            f'UPDATE files SET {assignments} WHERE path = ?',
+            (*fields.values(), file_path))
+
+    def is_processed(self, file_path, size=None, mtime_ns=None):
+        """Arquivo já enviado neste caminho e sem alterações desde então"""
+        return self.row_is_processed(self.get(file_path), size, mtime_ns)
+
+    @classmethod
+    def row_is_processed(cls, row, size, mtime_ns):
+        if row is None or row['state'] not in cls.DONE_STATES:
+            return False
+        if row['size'] is None:
+            return True  # Registro migrado da lista antiga (apenas caminho)
+        return row['size'] == size and row['mtime_ns'] == mtime_ns
+
+    def find_by_checksum(self, checksum):
+        """Caminho de um documento já enviado com o mesmo conteúdo"""
+        rows = self._execute(
+            'SELECT path FROM files WHERE checksum = ? AND state IN (?, ?, ?) '
+            'LIMIT 1', (checksum, *self.DONE_STATES))
+        return rows[0]['path'] if rows else None
+
+    def schedule_retry(self, file_path, attempts, next_attempt_at, error):
+        self.set_state(file_path, 'retry', attempts=attempts,
+                       next_attempt_at=next_attempt_at, error=error)
+
+    def due_retries(self, prefix, now, limit=100):
+        """Arquivos em 'retry' sob a pasta cujo próximo envio já venceu"""
+        rows = self._execute(
+            'SELECT path FROM files WHERE state = ? AND next_attempt_at <= ? '
+            'AND path LIKE ? ESCAPE ? ORDER BY next_attempt_at LIMIT ?',
+            ('retry', now, self._like_prefix(prefix), '\\', limit))
+        return [row['path'] for row in rows]
+
+    def next_retry_at(self, prefix):
+        rows = self._execute(
+            'SELECT MIN(next_attempt_at) FROM files WHERE state = ? '
+            'AND path LIKE ? ESCAPE ?',
+            ('retry', self._like_prefix(prefix), '\\'))
+        return rows[0][0]
+
+    def pending_paths(self, prefix):
+        """Arquivos da pasta que estavam na fila (ou em envio) quando o
+        processo parou"""
+        rows = self._execute(
+            'SELECT path FROM files WHERE state = ? AND path LIKE ? ESCAPE ? '
+            'ORDER BY updated_at',
+            ('pending', self._like_prefix(prefix), '\\'))
+        return [row['path'] for row in rows]
+
+    def consuming_tasks(self, prefix):
+        """Arquivos enviados cuja tarefa de consumo ainda não terminou"""
+        return self._execute(
+            'SELECT path, task_id, updated_at FROM files WHERE state = ? '
+            'AND path LIKE ? ESCAPE ?',
+            ('consuming', self._like_prefix(prefix), '\\'))
+
+    def archived_before(self, prefix, cutoff, limit=500):
+        """Arquivos arquivados antes de cutoff (limpeza por retenção)"""
+        return self._execute(
+            'SELECT path, archived_path, archived_at FROM files '
+            'WHERE archived_at < ? AND path LIKE ? ESCAPE ? '
+            'ORDER BY archived_at LIMIT ?',
+            (cutoff, self._like_prefix(prefix), '\\', limit))
+
+    def set_archived_at(self, archived_path, archived_at):
+        """Atualiza a data de todos os registros de um mesmo arquivo (zip)"""
+        self._execute('UPDATE files SET archived_at = ? WHERE archived_path = ?',
+                      (archived_at, archived_path))
+
+    def forget_archive(self, archived_path):
+        """O arquivo arquivado foi apagado; o registro (e o checksum) fica"""
+        self._execute('UPDATE files SET archived_path = NULL, archived_at = NULL '
+                      'WHERE archived_path = ?', (archived_path,))
+
+    @staticmethod
+    def _like_prefix(prefix):
+        escaped = prefix.replace('\\', '\\\\').replace(
+            '%', '\\%').replace('_', '\\_')
+        return escaped + '%'
+
+    def count(self, state=None):
+        if state is None:
+            return self._execute('SELECT COUNT(*) FROM files')[0][0]
+        return self._execute(
+            'SELECT COUNT(*) FROM files WHERE state = ?', (state,))[0][0]
+
+    def clear(self):
+        """Esquece todos os arquivos registrados"""
+        self._execute('DELETE FROM files')
+
+    def get_meta(self, key, default=None):
+        rows = self._execute('SELECT value FROM meta WHERE key = ?', (key,))
+        return rows[0]['value'] if rows else default
+
+    def set_meta(self, key, value):
+        self._execute(
+            'INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)',
+            (key, value))
+
+    def delete_meta(self, key):
+        self._execute('DELETE FROM meta WHERE key = ?', (key,))
+
+    def migrate_legacy(self, processed_txt, index_jsonl=None):
+        """Importa processed_files.txt (e o índice JSONL) uma única vez.
+
+        A lista antiga tem duas linhas por upload: o caminho original e o
+        caminho em processados/. A segunda vira archived_path da primeira
+        em vez de um registro próprio.
+        """
+        if self.get_meta('legacy_migrated'):
+            return 0
+
+        rows = {}
+        last_original = None
+        if os.path.exists(processed_txt):
+            with open(processed_txt, 'r', encoding='utf-8') as f:
+                for line in f:
+                    path = line.strip()
+                    if not path:
+                        continue
+                    if 'processados' in Path(path).parts:
+                        if last_original in rows:
+                            rows[last_original]['archived_path'] = path
+                        last_original = None
+                        continue
+                    rows[path] = {'archived_path': None, 'checksum': None,
+                                  'size': None, 'mtime_ns': None}
+                    last_original = path
+
+        if index_jsonl and os.path.exists(index_jsonl):
+            with open(index_jsonl, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                        path = entry['path']
+                        row = rows.setdefault(path, {'archived_path': None})
+                        row.update(checksum=entry['checksum'],
+                                   size=entry.get('size'),
+                                   mtime_ns=entry.get('mtime_ns'))
+                    except (ValueError, KeyError):
+                        continue
+
+        now = time.time()
+        with self._lock:
+            self.conn.execute('BEGIN')
+            try:
+                self.conn.executemany(
+                    'INSERT OR IGNORE INTO files (path, state, size, mtime_ns, '
+                    'checksum, archived_path, updated_at) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    [(path, 'done', row['size'], row['mtime_ns'],
+                      row['checksum'], row['archived_path'], now)
+                     for path, row in rows.items()])
+                self.conn.execute(
+                    'INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)',
+                    ('legacy_migrated', datetime.now().isoformat()))
+                self.conn.execute('COMMIT')
+            except Exception:
+                self.conn.execute('ROLLBACK')
+                raise
+
+        # Mantém os arquivos antigos como backup, fora do caminho de leitura
+        for legacy in (processed_txt, index_jsonl):
+            if legacy and os.path.exists(legacy):
+                os.replace(legacy, legacy + '.migrated')
+        return len(rows)
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+
+def open_state_store(log):
+    """Abre o banco de estado do aplicativo e migra a lista antiga na
+    primeira execução. Bancos injetados (testes, benchmark) não passam por
+    aqui, para não consumir os arquivos reais do usuário"""
+    store = StateStore(app_data_path('paperless_state.db'))
+    try:
+        migrated = store.migrate_legacy(
+            app_data_path('processed_files.txt'),
+            app_data_path('processed_index.jsonl'))
+        if migrated:
+            log(f"📋 Migrados {migrated} arquivos processados para o banco de estado")
+    except Exception as e:
+        log(f"⚠️ Erro ao migrar lista de processados: {str(e)}")
+    return store
+
+
+class TokenBucket:
+    """Limite global de banda (bytes/s) compartilhado por todos os uploads"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst or rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount):
+        """Debita os bytes e retorna quantos segundos esperar (sem dormir),
+        para quem espera com asyncio.sleep"""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity,
+                              self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= amount
+            return -self.tokens / self.rate if self.tokens < 0 else 0
+
+    def consume(self, amount):
+        """Debita os bytes e dorme o necessário para respeitar a taxa"""
+        wait = self.reserve(amount)
+        if wait > 0:
+            time.sleep(wait)
+
+
+class MultipartStream:
+    """Corpo multipart/form-data gerado sob demanda a partir do arquivo.
+
+    O requests enviaria o corpo inteiro montado em memória; aqui o arquivo é
+    lido em blocos durante o envio, então a memória por upload é constante.
+    """
+
+    def __init__(self, file_path, filename, fields=(), field_name='document',
+                 content_type='application/octet-stream', chunk_size=64 * 1024,
+                 limiter=None, progress=None):
+        self.boundary = uuid.uuid4().hex
+        self.chunk_size = chunk_size
+        self.limiter = limiter
+        self.progress = progress
+        self.file = open(file_path, 'rb')
+        self.file_size = os.fstat(self.file.fileno()).st_size
+        self.file_sent = 0
+
+        head = b''
+        for name, value in fields:
+            head += self._part_header(name) + str(value).encode('utf-8') + b'\r\n'
+        head += self._part_header(field_name, filename, content_type)
+        tail = f'\r\n--{self.boundary}--\r\n'.encode('ascii')
+
+        self._segments = [head, self.file, tail]
+        self._index = 0
+        self._offset = 0
+        self.length = len(head) + self.file_size + len(tail)
+
+    def _part_header(self, name, filename=None, content_type=None):
+        disposition = f'form-data; name="{name}"'
+        if filename is not None:
+            # Estilo HTML5: UTF-8 direto, escapando aspas e quebras de linha
+            escaped = filename.replace('"', '%22').replace(
+                '\r', '%0D').replace('\n', '%0A')
+            disposition += f'; filename="{escaped}"'
+        header = f'--{self.boundary}\r\nContent-Disposition: {disposition}\r\n'
+        if content_type:
+            header += f'Content-Type: {content_type}\r\n'
+        return (header + '\r\n').encode('utf-8')
+
+    @property
+    def content_type(self):
+        return f'multipart/form-data; boundary={self.boundary}'
+
+    def __len__(self):
+        return self.length
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.length
+        out = bytearray()
+        while len(out) < size and self._index < len(self._segments):
+            segment = self._segments[self._index]
+            wanted = size - len(out)
+            if segment is self.file:
+                remaining = self.file_size - self.file_sent
+                piece = self.file.read(min(wanted, self.chunk_size, remaining))
+                if not piece:
+                    if remaining:
+                        raise IOError("Arquivo diminuiu durante o envio")
+                    self._index += 1
+                    continue
+                self.file_sent += len(piece)
+                if self.limiter:
+                    self.limiter.consume(len(piece))
+                if self.progress:
+                    self.progress(self.file_sent, self.file_size)
+            else:
+                piece = segment[self._offset:self._offset + wanted]
+                self._offset += len(piece)
+                if self._offset >= len(segment):
+                    self._index += 1
+                    self._offset = 0
+            out += piece
+        return bytes(out)
+
+    def __iter__(self):
+        while True:
+            chunk = self.read(self.chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class MetadataRule:
+    """Regra de metadados: regex sobre o caminho relativo e modelos de valores"""
+
+    FIELDS = ('title', 'correspondent', 'document_type', 'created')
+
+    def __init__(self, name, pattern, values, tags=(), route=None):
+        self.name = name
+        self.regex = re.compile(pattern, re.IGNORECASE)
+        self.values = values  # campo -> modelo ("{grupo}", "{stem}", ...)
+        self.tags = list(tags)
+        self.route = route
+
+    @classmethod
+    def from_section(cls, name, section):
+        values = {field: section.get(field, raw=True)
+                  for field in cls.FIELDS if section.get(field, raw=True)}
+        tags = [tag.strip() for tag in
+                section.get('tags', '', raw=True).split(',') if tag.strip()]
+        return cls(name, section.get('pattern', '', raw=True), values, tags,
+                   route=section.get('route', raw=True))
+
+    def apply(self, relative_path, metadata):
+        """Preenche metadata com os valores da regra se o caminho casar"""
+        match = self.regex.search(relative_path)
+        if not match:
+            return False
+        name = relative_path.rsplit('/', 1)[-1]
+        context = defaultdict(str, filename=name,
+                              stem=os.path.splitext(name)[0],
+                              folder=relative_path.rpartition('/')[0])
+        context.update({key: value for key, value in
+                        match.groupdict().items() if value is not None})
+
+        for field, template in self.values.items():
+            value = template.format_map(context).strip()
+            if value and field not in metadata:
+                metadata[field] = value  # A primeira regra que casar vence
+        for tag in self.tags:
+            tag = tag.format_map(context).strip()
+            if tag and tag not in metadata.setdefault('tags', []):
+                metadata['tags'].append(tag)
+        return True
+
+
+def load_metadata_rules(config, route_name='default'):
+    """Regras [rule:nome] da configuração, na ordem do arquivo"""
+    rules = []
+    for section in config.sections():
+        if not section.startswith('rule:'):
+            continue
+        rule = MetadataRule.from_section(
+            section.split(':', 1)[1].strip(), config[section])
+        if rule.route in (None, route_name):
+            rules.append(rule)
+    return rules
+
+
+class PaperlessLookupCache:
+    """Cache em memória de nome -> ID de tags, correspondentes e tipos de
+    documento, carregado em lote (paginado) e renovado por TTL"""
+
+    KINDS = ('tags', 'correspondents', 'document_types')
+
+    def __init__(self, session, base_url, ttl=3600.0, min_refresh=60.0):
+        self.session = session
+        self.base_url = base_url
+        self.ttl = ttl
+        self.min_refresh = min_refresh
+        self._maps = {}  # tipo -> {nome em minúsculas: id}
+        self._loaded_at = {}
+        self._lock = threading.Lock()
+
+    def _load(self, kind):
+        """Busca todas as páginas de /api/<tipo>/ (chamado com o lock)"""
+        mapping = {}
+        url = f'{self.base_url}/api/{kind}/'
+        params = {'page_size': 1000, 'fields': 'id,name'}
+        while url:
+            response = self.session.get(url, params=params, timeout=30)
+            response.raise_for_status()
+            data = response.json()
+            for item in data.get('results', []):
+                mapping[item['name'].strip().lower()] = item['id']
+            url, params = data.get('next'), None  # 'next' já traz os parâmetros
+        self._maps[kind] = mapping
+        self._loaded_at[kind] = time.monotonic()
+
+    def resolve(self, kind, name):
+        """ID do objeto pelo nome; recarrega se expirado ou se o nome for novo"""
+        key = name.strip().lower()
+        with self._lock:
+            age = time.monotonic() - self._loaded_at.get(kind, float('-inf'))
+            if age > self.ttl:
+                self._load(kind)
+            elif key not in self._maps[kind] and age > self.min_refresh:
+                self._load(kind)  # Pode ter sido criado há pouco no Paperless
+            return self._maps[kind].get(key)
+
+    def invalidate(self, kind=None):
+        """Descarta o cache (ex.: o servidor rejeitou um ID em cache)"""
+        with self._lock:
+            for k in ([kind] if kind else self.KINDS):
+                self._loaded_at.pop(k, None)
+
+
+def optimize_document(src_path, out_dir, options):
+    """Recomprime/converte uma imagem escaneada com Pillow.
+
+    Roda em outro processo (ProcessPoolExecutor) para não disputar o GIL com
+    as threads de upload. Retorna (caminho_gerado, tamanho_original,
+    tamanho_novo, segundos).
+    """
+    from PIL import Image, ImageSequence
+
+    started = time.perf_counter()
+    original_size = os.path.getsize(src_path)
+    stem, ext = os.path.splitext(os.path.basename(src_path))
+    ext = ext.lower()
+
+    with Image.open(src_path) as img:
+        dpi = img.info.get('dpi')
+        frames = [frame.copy() for frame in ImageSequence.Iterator(img)]
+
+    # Reduz digitalizações com resolução acima do necessário para OCR
+    max_dpi = options.get('max_dpi') or 0
+    if dpi and max_dpi and max(dpi) > max_dpi:
+        scale = max_dpi / max(dpi)
+        frames = [frame.resize((max(1, round(frame.width * scale)),
+                                max(1, round(frame.height * scale))),
+                               Image.LANCZOS) for frame in frames]
+        dpi = (dpi[0] * scale, dpi[1] * scale)
+
+    save_options = {'dpi': dpi} if dpi else {}
+    if ext in ('.tif', '.tiff') and options.get('tiff_to_pdf'):
+        # Todas as páginas do TIFF num único PDF
+        frames = [frame if frame.mode in ('1', 'L', 'RGB', 'CMYK')
+                  else frame.convert('RGB') for frame in frames]
+        out_path = os.path.join(out_dir, stem + '.pdf')
+        frames[0].save(out_path, 'PDF', save_all=True,
+                       append_images=frames[1:],
+                       resolution=max(dpi) if dpi else 72.0)
+    elif ext in ('.tif', '.tiff'):
+        out_path = os.path.join(out_dir, stem + ext)
+        compression = 'group4' if frames[0].mode == '1' else 'tiff_lzw'
+        frames[0].save(out_path, save_all=True, append_images=frames[1:],
+                       compression=compression, **save_options)
+    elif ext in ('.jpg', '.jpeg'):
+        out_path = os.path.join(out_dir, stem + ext)
+        frame = frames[0] if frames[0].mode in ('L', 'RGB', 'CMYK') \
+            else frames[0].convert('RGB')
+        frame.save(out_path, 'JPEG', quality=options.get('jpeg_quality', 85),
+                   optimize=True, **save_options)
+    else:
+        out_path = os.path.join(out_dir, stem + ext)
+        frames[0].save(out_path, 'PNG', optimize=True, **save_options)
+
+    return (out_path, original_size, os.path.getsize(out_path),
+            time.perf_counter() - started)
+
+
+class ImageOptimizer:
+    """Etapa opcional antes do upload: otimiza imagens num pool de processos"""
+
+    EXTENSIONS = {'.tif', '.tiff', '.png', '.jpg', '.jpeg'}
+
+    def __init__(self, max_workers=2, max_dpi=300, jpeg_quality=85,
+                 tiff_to_pdf=True, min_saving=0.05):
+        self.max_workers = max(1, max_workers)
+        self.options = {'max_dpi': max_dpi, 'jpeg_quality': jpeg_quality,
+                        'tiff_to_pdf': tiff_to_pdf}
+        self.min_saving = min_saving
+        self.available = importlib.util.find_spec('PIL') is not None
+        self.executor = None
+        self.stats = {'files': 0, 'optimized': 0, 'bytes_before': 0,
+                      'bytes_after': 0, 'seconds': 0.0}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls, settings):
+        """Cria o otimizador se habilitado em optimize_images"""
+        if not settings.getboolean('optimize_images', fallback=False):
+            return None
+        return cls(
+            max_workers=settings.getint(
+                'optimize_workers', fallback=max(1, (os.cpu_count() or 2) // 2)),
+            max_dpi=settings.getint('optimize_max_dpi', fallback=300),
+            jpeg_quality=settings.getint('optimize_jpeg_quality', fallback=85),
+            tiff_to_pdf=settings.getboolean('optimize_tiff_to_pdf', fallback=True),
+            min_saving=settings.getfloat('optimize_min_saving', fallback=0.05))
+
+    def optimize(self, file_path):
+        """Retorna o caminho do arquivo otimizado (temporário) ou None"""
+        if not self.available or \
+                os.path.splitext(file_path)[1].lower() not in self.EXTENSIONS:
+            return None
+        with self._lock:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        out_dir = tempfile.mkdtemp(prefix='paperless_opt_')
+        try:
+            out_path, before, after, elapsed = self.executor.submit(
+                optimize_document, file_path, out_dir, self.options).result()
+        except BaseException:
+            shutil.rmtree(out_dir, ignore_errors=True)
+            raise
+
+        converted = os.path.splitext(out_path)[1].lower() != \
+            os.path.splitext(file_path)[1].lower()
+        useful = converted or after <= before * (1 - self.min_saving)
+        with self._lock:
+            self.stats['files'] += 1
+            self.stats['seconds'] += elapsed
+            self.stats['bytes_before'] += before
+            self.stats['bytes_after'] += after if useful else before
+            if useful:
+                self.stats['optimized'] += 1
+        if not useful:
+            shutil.rmtree(out_dir, ignore_errors=True)
+            return None
+        return out_path
+
+    @staticmethod
+    def cleanup(optimized_path):
+        shutil.rmtree(os.path.dirname(optimized_path), ignore_errors=True)
+
+    def summary(self):
+        with self._lock:
+            stats = dict(self.stats)
+        saved = stats['bytes_before'] - stats['bytes_after']
+        return (f"🗜️ Otimização: {stats['optimized']}/{stats['files']} arquivo(s), "
+                f"{saved / 1048576:.1f} MB economizados em {stats['seconds']:.1f}s")
+
+    def shutdown(self):
+        with self._lock:
+            executor, self.executor = self.executor, None
+        if executor:
+            executor.shutdown(wait=True)
+
+
+def natural_sort_key(path):
+    """Ordena 'pag2' antes de 'pag10'"""
+    return [int(part) if part.isdigit() else part.lower()
+            for part in re.split(r'(\d+)', os.path.basename(path))]
+
+
+def merge_documents(paths, out_path):
+    """Junta imagens e PDFs, na ordem dada, num único PDF.
+
+    Roda em outro processo (ProcessPoolExecutor). Imagens usam só o Pillow;
+    PDFs no lote exigem o pypdf. Retorna o tamanho do PDF gerado.
+    """
+    from PIL import Image, ImageSequence
+
+    def image_pages(path):
+        with Image.open(path) as img:
+            dpi = img.info.get('dpi')
+            pages = [frame.copy() if frame.mode in ('1', 'L', 'RGB', 'CMYK')
+                     else frame.convert('RGB')
+                     for frame in ImageSequence.Iterator(img)]
+        return pages, (max(dpi) if dpi else 72.0)
+
+    if not any(path.lower().endswith('.pdf') for path in paths):
+        pages = []
+        for path in paths:
+            frames, resolution = image_pages(path)
+            pages.extend(frames)
+        pages[0].save(out_path, 'PDF', save_all=True,
+                      append_images=pages[1:], resolution=resolution)
+        return os.path.getsize(out_path)
+
+    import io
+    from pypdf import PdfWriter
+
+    writer = PdfWriter()
+    for path in paths:
+        if path.lower().endswith('.pdf'):
+            writer.append(path)
+        else:
+            frames, resolution = image_pages(path)
+            buffer = io.BytesIO()
+            frames[0].save(buffer, 'PDF', save_all=True,
+                           append_images=frames[1:], resolution=resolution)
+            buffer.seek(0)
+            writer.append(buffer)
+    with open(out_path, 'wb') as f:
+        writer.write(f)
+    return os.path.getsize(out_path)
+
+
+class BatchRule:
+    """Regra de lote: arquivos que casam com o padrão, na mesma subpasta e
+    com o mesmo prefixo (ou grupo nomeado 'group'), viram um só documento"""
+
+    EXTENSIONS = {'.pdf', '.png', '.jpg', '.jpeg', '.tif', '.tiff'}
+    # Sufixo numérico de páginas: "scan_001", "scan-2", "scan 3"
+    PAGE_SUFFIX = re.compile(r'[\s_.-]*\d+$')
+
+    def __init__(self, name, pattern, window=30.0, max_files=100, route=None):
+        self.name = name
+        self.regex = re.compile(pattern, re.IGNORECASE)
+        self.window = window
+        self.max_files = max(2, max_files)
+        self.route = route
+
+    @classmethod
+    def from_section(cls, name, section):
+        return cls(name, section.get('pattern', '', raw=True),
+                   window=section.getfloat('window', fallback=30.0),
+                   max_files=section.getint('max_files', fallback=100),
+                   route=section.get('route', raw=True))
+
+    def group_key(self, relative_path):
+        """Chave do lote do arquivo, ou None se a regra não se aplica"""
+        name = relative_path.rsplit('/', 1)[-1]
+        stem, ext = os.path.splitext(name)
+        if ext.lower() not in self.EXTENSIONS:
+            return None
+        match = self.regex.search(relative_path)
+        if not match:
+            return None
+        group = match.groupdict().get('group')
+        if group is None:
+            group = self.PAGE_SUFFIX.sub('', stem) or stem
+        return (self.name, relative_path.rpartition('/')[0], group)
+
+
+def load_batch_rules(config, route_name='default'):
+    """Regras [batch:nome] da configuração, na ordem do arquivo"""
+    rules = []
+    for section in config.sections():
+        if not section.startswith('batch:'):
+            continue
+        rule = BatchRule.from_section(
+            section.split(':', 1)[1].strip(), config[section])
+        if rule.route in (None, route_name):
+            rules.append(rule)
+    return rules
+
+
+class BatchCoalescer:
+    """Agrupa arquivos pequenos que chegam em sequência e entrega cada lote
+    (via on_flush) quando a janela fecha sem novas chegadas ou ele enche"""
+
+    def __init__(self, rules, on_flush):
+        self.rules = rules
+        self.on_flush = on_flush  # callable(nome_do_lote, [caminhos])
+        self._groups = {}  # chave -> {'paths', 'deadline', 'rule'}
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopped = False
+        # Imagens se juntam só com Pillow; PDFs no lote exigem o pypdf
+        self.pil_available = importlib.util.find_spec('PIL') is not None
+        self.pypdf_available = importlib.util.find_spec('pypdf') is not None
+        self.executor = None
+        self.logger = logging.getLogger(__name__)
+
+    def add(self, file_path, relative_path):
+        """Coloca o arquivo num lote; False se nenhuma regra se aplica"""
+        for rule in self.rules:
+            key = rule.group_key(relative_path)
+            if key is not None:
+                break
+        else:
+            return False
+
+        full = None
+        with self._cond:
+            if self._stopped:
+                return False
+            group = self._groups.setdefault(
+                key, {'paths': [], 'rule': rule, 'deadline': 0.0})
+            group['paths'].append(file_path)
+            group['deadline'] = time.monotonic() + rule.window
+            if len(group['paths']) >= rule.max_files:
+                full = self._groups.pop(key)
+            self._start()
+            self._cond.notify()
+        if full is not None:
+            self._flush(key, full)
+        return True
+
+    def pending_count(self):
+        with self._cond:
+            return sum(len(group['paths']) for group in self._groups.values())
+
+    def can_merge(self, paths):
+        if not self.pil_available:
+            return False
+        return self.pypdf_available or \
+            not any(path.lower().endswith('.pdf') for path in paths)
+
+    def merge(self, paths, name):
+        """Gera o PDF do lote num diretório temporário (pool de processos)"""
+        with self._cond:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(max_workers=1)
+            executor = self.executor
+        out_dir = tempfile.mkdtemp(prefix='paperless_batch_')
+        out_path = os.path.join(out_dir, f'{name}.pdf')
+        try:
+            executor.submit(merge_documents, paths, out_path).result()
+        except BaseException:
+            shutil.rmtree(out_dir, ignore_errors=True)
+            raise
+        return out_path
+
+    @staticmethod
+    def cleanup(merged_path):
+        shutil.rmtree(os.path.dirname(merged_path), ignore_errors=True)
+
+    @staticmethod
+    def batch_name(key):
+        _, folder, group = key
+        return group or folder.rsplit('/', 1)[-1] or 'lote'
+
+    def _flush(self, key, group):
+        try:
+            self.on_flush(self.batch_name(key), group['paths'])
+        except Exception:
+            self.logger.exception("Erro ao entregar lote %s", key)
+
+    def _start(self):
+        """Inicia a thread de prazos (chamado com o lock)"""
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name='batch-coalescer', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._stopped:
+                    now = time.monotonic()
+                    expired = [key for key, group in self._groups.items()
+                               if group['deadline'] <= now]
+                    if expired:
+                        break
+                    timeout = min((group['deadline'] for group in
+                                   self._groups.values()), default=now + 60) - now
+                    self._cond.wait(timeout)
+                if self._stopped:
+                    return
+                ready = [(key, self._groups.pop(key)) for key in expired]
+            for key, group in ready:
+                self._flush(key, group)
+
+    def stop(self, flush=True):
+        """Encerra a thread; lotes abertos são entregues na hora se flush"""
+        with self._cond:
+            self._stopped = True
+            remaining, self._groups = list(self._groups.items()), {}
+            self._cond.notify()
+            thread, self._thread = self._thread, None
+        if thread and thread is not threading.current_thread():
+            thread.join(timeout=5)
+        if flush:
+            for key, group in remaining:
+                self._flush(key, group)
+        return remaining
+
+    def shutdown(self):
+        """Encerra o pool de processos (depois que os lotes foram enviados)"""
+        with self._cond:
+            executor, self.executor = self.executor, None
+        if executor:
+            executor.shutdown(wait=True)
+
+
+class PriorityRule:
+    """Regra de prioridade: arquivos cujo caminho relativo casa com o padrão
+    entram na fila com a prioridade dada (maior = antes). Cada ponto vale
+    um degrau de schedule_aging segundos, como uma classe de tamanho"""
+
+    def __init__(self, name, pattern, priority=0.0, route=None):
+        self.name = name
+        self.regex = re.compile(pattern, re.IGNORECASE)
+        self.priority = priority
+        self.route = route
+
+    @classmethod
+    def from_section(cls, name, section):
+        return cls(name, section.get('pattern', '', raw=True),
+                   priority=section.getfloat('priority', fallback=0.0),
+                   route=section.get('route', raw=True))
+
+    def matches(self, relative_path):
+        return self.regex.search(relative_path) is not None
+
+
+def load_priority_rules(config, route_name='default'):
+    """Regras [priority:nome] da configuração, na ordem do arquivo"""
+    rules = []
+    for section in config.sections():
+        if not section.startswith('priority:'):
+            continue
+        rule = PriorityRule.from_section(
+            section.split(':', 1)[1].strip(), config[section])
+        if rule.route in (None, route_name):
+            rules.append(rule)
+    return rules
+
+
+class Histogram:
+    """Histograma de buckets fixos (formato Prometheus): observar é um
+    bisect e dois incrementos, sem alocação"""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)  # último = +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Estimativa pelo limite superior do bucket (None se vazio)"""
+        if not self.count:
+            return None
+        target = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return float('inf')
+
+
+class Metrics:
+    """Registro de contadores, histogramas e gauges do pipeline de upload"""
+
+    PREFIX = 'paperless_uploader'
+    TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                    10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+    DESCRIPTIONS = {
+        'detect_to_upload_seconds':
+            'Tempo da detecção do arquivo até a resposta do upload',
+        'stability_wait_seconds': 'Espera até o arquivo parar de ser escrito',
+        'hash_seconds': 'Tempo de cálculo do MD5 (apenas sem cache)',
+        'http_upload_seconds': 'Duração da requisição post_document',
+        'bytes_sent_total': 'Bytes enviados ao Paperless',
+        'uploads_total': 'Uploads por código de status HTTP (error = sem resposta)',
+        'queue_depth': 'Trabalhos aguardando no pool de upload',
+        'in_flight_uploads': 'Uploads em andamento',
+        'stability_pending_files': 'Arquivos aguardando parar de ser escritos',
+        'server_up': '1 se o servidor responde, 0 se os uploads estão pausados',
+        'queue_wait_seconds': 'Espera na fila do pool por classe de tamanho e '
+                              'origem (live ou backlog)',
+        'queue_depth_by_class': 'Trabalhos aguardando por classe de tamanho e '
+                                'origem',
+        'fs_events_total': 'Eventos de arquivo por destino (tracked, coalesced, '
+                           'ignored, processed)',
+    }
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = defaultdict(float)  # (nome, rótulos) -> valor
+        self._histograms = {}  # (nome, rótulos) -> Histogram
+        self._gauges = []  # (nome, rótulos, função)
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted((key, str(value))
+                                  for key, value in labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] += value
+
+    def observe(self, name, value, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(self.TIME_BUCKETS)
+            histogram.observe(value)
+
+    def gauge(self, name, func, **labels):
+        """Gauge calculado na leitura (ex.: tamanho da fila)"""
+        with self._lock:
+            self._gauges.append(self._key(name, labels) + (func,))
+
+    def _collect(self):
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: (hist.buckets, list(hist.counts), hist.sum,
+                                hist.count, hist.quantile(0.5),
+                                hist.quantile(0.99))
+                          for key, hist in self._histograms.items()}
+            gauges = list(self._gauges)
+        values = {}
+        for name, labels, func in gauges:
+            try:
+                values[(name, labels)] = func()
+            except Exception:
+                continue  # Ex.: pool já encerrado
+        return counters, histograms, values
+
+    @staticmethod
+    def _labels(labels, extra=()):
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ''
+        escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"')
+                   .replace('\n', '\\n') for _, value in pairs)
+        return '{' + ','.join(f'{key}="{value}"' for (key, _), value
+                              in zip(pairs, escaped)) + '}'
+
+    def render(self):
+        """Texto no formato de exposição do Prometheus"""
+        counters, histograms, gauges = self._collect()
+        lines = []
+        declared = set()
+
+        def declare(name, kind):
+            if name not in declared:
+                declared.add(name)
+                full = f'{self.PREFIX}_{name}'
+                lines.append(f'# HELP {full} {self.DESCRIPTIONS.get(name, name)}')
+                lines.append(f'# TYPE {full} {kind}')
+            return f'{self.PREFIX}_{name}'
+
+        for (name, labels), value in sorted(counters.items()):
+            full = declare(name, 'counter')
+            lines.append(f'{full}{self._labels(labels)} {value:g}')
+        for (name, labels), value in sorted(gauges.items()):
+            full = declare(name, 'gauge')
+            lines.append(f'{full}{self._labels(labels)} {value:g}')
+        for (name, labels), (buckets, counts, total, count, _, _) in \
+                sorted(histograms.items()):
+            full = declare(name, 'histogram')
+            cumulative = 0
+            for bound, bucket_count in zip(buckets + ('+Inf',), counts):
+                cumulative += bucket_count
+                le = bound if isinstance(bound, str) else f'{bound:g}'
+                lines.append(f'{full}_bucket'
+                             f'{self._labels(labels, [("le", le)])} {cumulative}')
+            lines.append(f'{full}_sum{self._labels(labels)} {total:g}')
+            lines.append(f'{full}_count{self._labels(labels)} {count}')
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self):
+        """Resumo em dicionário (JSON): contadores, gauges e p50/p99"""
+        counters, histograms, gauges = self._collect()
+
+        def label_key(labels):
+            return ','.join(f'{key}={value}' for key, value in labels) or 'total'
+
+        result = {'timestamp': datetime.now().isoformat(timespec='seconds'),
+                  'counters': {}, 'gauges': {}, 'histograms': {}}
+        for (name, labels), value in counters.items():
+            result['counters'].setdefault(name, {})[label_key(labels)] = value
+        for (name, labels), value in gauges.items():
+            result['gauges'].setdefault(name, {})[label_key(labels)] = value
+        for (name, labels), (_, _, total, count, p50, p99) in histograms.items():
+            result['histograms'].setdefault(name, {})[label_key(labels)] = {
+                'count': count, 'sum': round(total, 6),
+                'avg': round(total / count, 6) if count else None,
+                'p50': p50, 'p99': p99 if p99 != float('inf') else 'inf'}
+        return result
+
+
+class MetricsExporter:
+    """Servidor HTTP local com /metrics (Prometheus) e /stats.json, e
+    gravação periódica do resumo JSON em arquivo"""
+
+    def __init__(self, metrics, port=0, bind='127.0.0.1', stats_file=None,
+                 stats_interval=60.0):
+        self.metrics = metrics
+        self.port = port
+        self.bind = bind
+        self.stats_file = stats_file
+        self.stats_interval = max(1.0, stats_interval)
+        self.server = None
+        self._stopped = threading.Event()
+        self._threads = []
+        self.logger = logging.getLogger(__name__)
+
+    @classmethod
+    def from_settings(cls, metrics, settings):
+        """Cria o exportador se metrics_port ou stats_file estiverem definidos"""
+        port = settings.getint('metrics_port', fallback=0)
+        stats_file = settings.get('stats_file', '').strip() or None
+        if not port and not stats_file:
+            return None
+        return cls(metrics, port=port,
+                   bind=settings.get('metrics_bind', '127.0.0.1').strip(),
+                   stats_file=stats_file,
+                   stats_interval=settings.getfloat('stats_interval', fallback=60.0))
+
+    def start(self):
+        if self.port:
+            metrics = self.metrics
+
+            class Handler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    path = self.path.split('?', 1)[0]
+                    if path == '/metrics':
+                        body = metrics.render().encode('utf-8')
+                        content_type = 'text/plain; version=0.0.4; charset=utf-8'
+                    elif path == '/stats.json':
+                        body = json.dumps(metrics.snapshot()).encode('utf-8')
+                        content_type = 'application/json'
+                    else:
+                        self.send_error(404)
+                        return
+                    self.send_response(200)
+                    self.send_header('Content-Type', content_type)
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, format, *args):
+                    pass  # Sem uma linha de log por coleta do Prometheus
+
+            self.server = ThreadingHTTPServer((self.bind, self.port), Handler)
+            self.server.daemon_threads = True
+            self._spawn(self.server.serve_forever, 'metrics-http')
+        if self.stats_file:
+            self._spawn(self._dump_loop, 'stats-dump')
+
+    def _spawn(self, target, name):
+        thread = threading.Thread(target=target, name=name, daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def dump(self):
+        """Grava o resumo JSON de forma atômica (arquivo temporário + rename)"""
+        tmp_path = f'{self.stats_file}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.metrics.snapshot(), f, indent=2)
+        os.replace(tmp_path, self.stats_file)
+
+    def _dump_loop(self):
+        while not self._stopped.wait(self.stats_interval):
+            try:
+                self.dump()
+            except OSError as e:
+                self.logger.warning("Falha ao gravar %s: %s", self.stats_file, e)
+
+    def stop(self):
+        self._stopped.set()
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+        for thread in self._threads:
+            thread.join(timeout=5)
+        self._threads = []
+        if self.stats_file:
+            try:
+                self.dump()  # Estado final
+            except OSError as e:
+                self.logger.warning("Falha ao gravar %s: %s", self.stats_file, e)
+
+
+def create_session(headers=None, pool_size=10):
+    """Cria uma sessão HTTP persistente (keep-alive) com pool de conexões"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(1, pool_size))
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    if headers:
+        session.headers.update(headers)
+    return session
+
+
+def session_connection_stats(session):
+    """Retorna contadores de requisições e conexões abertas pela sessão"""
+    total_requests = 0
+    total_connections = 0
+    seen = set()
+    for adapter in session.adapters.values():
+        if id(adapter) in seen or not hasattr(adapter, 'poolmanager'):
+            continue
+        seen.add(id(adapter))
+        pools = adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            total_requests += pool.num_requests
+            total_connections += pool.num_connections
+    return {
+        'requests': total_requests,
+        'connections': total_connections,
+        'reused': max(0, total_requests - total_connections),
+    }
+
+
+class UploadWorkerPool:
+    """Pool de workers compartilhado por várias rotas (pasta -> servidor).
+
+    Cada rota tem a própria fila limitada (backpressure independente) e um
+    limite de uploads simultâneos; os workers atendem as rotas em rodízio,
+    então uma pasta com muitos arquivos não bloqueia as demais.
+
+    Dentro da rota, a fila é uma fila de prioridade: a chave de cada
+    trabalho é o instante de entrada mais um atraso por classe de tamanho
+    (shortest-job-first), pela origem (itens da varredura cedem a vez aos
+    que chegam ao vivo) e menos a prioridade da pasta. Como a chave é fixa
+    e o tempo corre igual para todos, um arquivo grande passa à frente dos
+    novos depois de esperar o seu atraso: ninguém espera para sempre.
+    """
+
+    is_async = False
+    SIZE_CLASSES = ('small', 'medium', 'large')
+    SOURCES = ('live', 'backlog')
+
+    def __init__(self, max_workers=4, queue_size=100, name='upload',
+                 aging=60.0, backlog_delay=600.0,
+                 size_limits=(1024 * 1024, 25 * 1024 * 1024)):
+        self.max_workers = max(1, max_workers)
+        self.queue_size = max(1, queue_size)
+        self.name = name
+        self.aging = aging  # Atraso (s) por classe de tamanho / ponto de prioridade
+        self.backlog_delay = backlog_delay
+        self.size_limits = tuple(size_limits)  # Fronteiras small/medium/large
+        self.metrics = None  # Tempo de espera por classe (definido pelo uploader)
+        self.workers = []
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+        self._queues = {}  # rota -> heap de trabalhos (ver submit)
+        self._counts = {}  # rota -> trabalhos na fila por origem
+        self._limits = {}  # rota -> uploads simultâneos permitidos
+        self._in_flight = {}  # rota -> uploads em andamento
+        self._queue_sizes = {}  # rota -> tamanho máximo da fila
+        self._rotation = deque()  # ordem de atendimento das rotas
+        self._paused = set()  # rotas cujo servidor está fora do ar
+        self._generation = 0  # workers de gerações antigas encerram ao ficar ociosos
+        self._draining = False  # drain(): a fila não é mais atendida
+        self.logger = logging.getLogger(__name__)
+
+    def add_route(self, route, max_concurrency=None, queue_size=None):
+        """Registra (ou reconfigura) uma rota com limite de concorrência próprio"""
+        with self._cond:
+            if route not in self._queues:
+                self._queues[route] = []
+                self._counts[route] = dict.fromkeys(self.SOURCES, 0)
+                self._in_flight[route] = 0
+                self._rotation.append(route)
+            self._limits[route] = min(
+                max(1, max_concurrency or self.max_workers), self.max_workers)
+            self._queue_sizes[route] = max(1, queue_size or self.queue_size)
+
+    def start(self):
+        """Inicia os workers (idempotente)"""
+        with self._cond:
+            if self.workers:
+                return
+            for i in range(self.max_workers):
+                worker = threading.Thread(
+                    target=self._worker_loop, args=(self._generation,),
+                    name=f'{self.name}-{i}', daemon=True)
+                worker.start()
+                self.workers.append(worker)
+
+    def size_class(self, size):
+        """Índice da classe de tamanho (0 = small) de um arquivo"""
+        return bisect.bisect_right(self.size_limits, size or 0)
+
+    def submit(self, func, *args, route='default', timeout=None, size=None,
+               priority=0, backlog=False):
+        """Coloca um trabalho na fila da rota, bloqueando enquanto ela estiver
+        cheia. Itens da varredura (backlog=True) têm limite de fila próprio:
+        uma varredura grande nunca bloqueia os arquivos que chegam ao vivo.
+        Retorna False (sem enfileirar) se o pool estiver sendo drenado"""
+        self.start()
+        source = 'backlog' if backlog else 'live'
+        level = self.size_class(size)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            if route not in self._queues:
+                self.add_route(route)
+            counts = self._counts[route]
+            while counts[source] >= self._queue_sizes[route]:
+                if self._draining:
+                    return False
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise queue.Full
+                self._cond.wait(remaining)
+            if self._draining:
+                return False
+            now = time.monotonic()
+            key = now + (level - priority) * self.aging
+            if backlog:
+                key += self.backlog_delay
+            heapq.heappush(self._queues[route], (
+                key, next(self._seq), func, args, self.SIZE_CLASSES[level],
+                source, now))
+            counts[source] += 1
+            self._cond.notify_all()
+        return True
+
+    def pending(self, route=None):
+        """Quantidade de trabalhos aguardando (total ou de uma rota)"""
+        with self._cond:
+            if route is not None:
+                return len(self._queues.get(route, ()))
+            return sum(len(jobs) for jobs in self._queues.values())
+
+    def pending_by_class(self, route):
+        """Trabalhos aguardando na rota por (classe de tamanho, origem)"""
+        with self._cond:
+            jobs = list(self._queues.get(route, ()))
+        counts = defaultdict(int)
+        for job in jobs:
+            counts[job[4], job[5]] += 1
+        return counts
+
+    def in_flight(self, route=None):
+        with self._cond:
+            if route is not None:
+                return self._in_flight.get(route, 0)
+            return sum(self._in_flight.values())
+
+    def pause(self, route):
+        """Workers deixam de pegar trabalhos da rota; a fila é mantida"""
+        with self._cond:
+            self._paused.add(route)
+
+    def resume(self, route):
+        with self._cond:
+            self._paused.discard(route)
+            self._cond.notify_all()
+
+    def is_paused(self, route):
+        with self._cond:
+            return route in self._paused
+
+    def _next_job(self):
+        """Próximo trabalho em rodízio entre as rotas com vaga e, na rota, o
+        de menor chave (lock adquirido). Retorna (rota, func, args) ou None"""
+        if self._draining:
+            return None
+        for _ in range(len(self._rotation)):
+            route = self._rotation[0]
+            self._rotation.rotate(-1)
+            jobs = self._queues[route]
+            if jobs and route not in self._paused and \
+                    self._in_flight[route] < self._limits[route]:
+                self._in_flight[route] += 1
+                _, _, func, args, size_class, source, enqueued = \
+                    heapq.heappop(jobs)
+                self._counts[route][source] -= 1
+                if self.metrics is not None:
+                    self.metrics.observe(
+                        'queue_wait_seconds', time.monotonic() - enqueued,
+                        route=route, size_class=size_class, source=source)
+                return route, func, args
+        return None
+
+    def _worker_loop(self, generation):
+        while True:
+            with self._cond:
+                job = self._next_job()
+                while job is None:
+                    if generation != self._generation:
+                        return
+                    self._cond.wait()
+                    job = self._next_job()
+                # Liberou espaço na fila: acorda quem está em submit()
+                self._cond.notify_all()
+
+            route, func, args = job
+            try:
+                func(*args)
+            except Exception:
+                self.logger.exception("Erro não tratado no worker de upload")
+            finally:
+                with self._cond:
+                    self._in_flight[route] -= 1
+                    self._cond.notify_all()
+
+    def drain(self, timeout=None):
+        """Encerramento gracioso: nenhum trabalho novo é aceito nem retirado
+        da fila, e os uploads em andamento têm até timeout segundos para
+        terminar. A fila é descartada (o banco de estado mantém esses
+        arquivos como 'pending'); retorna True se nada ficou em andamento"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            self._draining = True
+            self._cond.notify_all()  # Acorda quem espera vaga em submit()
+            while any(self._in_flight.values()):
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            for route, jobs in self._queues.items():
+                jobs.clear()
+                self._counts[route] = dict.fromkeys(self.SOURCES, 0)
+            return not any(self._in_flight.values())
+
+    def stop(self, wait=True):
+        """Encerra os workers depois de esvaziar as filas"""
+        with self._cond:
+            workers, self.workers = self.workers, []
+            self._generation += 1
+            self._cond.notify_all()
+        if wait:
+            for worker in workers:
+                worker.join()
+
+
+class AsyncUploadPool(UploadWorkerPool):
+    """Engine async: as mesmas filas por rota, rodízio e backpressure do
+    UploadWorkerPool, mas os trabalhos rodam num único event loop asyncio.
+
+    submit() (chamado pelas threads do watchdog) entrega o trabalho ao loop
+    com call_soon_threadsafe. Corrotinas (upload_file_async) esperam a rede
+    sem ocupar uma thread; funções comuns vão para o executor padrão.
+    max_workers aqui é o número de uploads simultâneos, não de threads.
+    """
+
+    is_async = True
+
+    def __init__(self, max_workers=64, queue_size=100, name='upload-async',
+                 **options):
+        super().__init__(max_workers, queue_size, name, **options)
+        self.loop = None
+        self._thread = None
+        self._running = 0
+        self._closing = False
+        self._sessions = {}  # (url, token) -> aiohttp.ClientSession
+
+    def start(self):
+        with self._cond:
+            if self._thread is not None:
+                return
+            _load_async_modules()
+            self._closing = False
+            self.loop = asyncio.new_event_loop()
+            self._thread = threading.Thread(
+                target=self._run_loop, name=self.name, daemon=True)
+            self._thread.start()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_forever()
+        finally:
+            self.loop.close()
+
+    def submit(self, func, *args, **kwargs):
+        if not super().submit(func, *args, **kwargs):
+            return False
+        self.loop.call_soon_threadsafe(self._dispatch)
+        return True
+
+    def resume(self, route):
+        super().resume(route)
+        if self.loop is not None and self._thread is not None:
+            self.loop.call_soon_threadsafe(self._dispatch)
+
+    def session_for(self, base_url, headers, limit_per_host):
+        """Sessão aiohttp por servidor, com limite de conexões por host
+        (chamado no loop)"""
+        key = (base_url, headers.get('Authorization'))
+        session = self._sessions.get(key)
+        if session is None:
+            connector = aiohttp.TCPConnector(limit=self.max_workers,
+                                             limit_per_host=limit_per_host)
+            session = aiohttp.ClientSession(headers=headers, connector=connector)
+            self._sessions[key] = session
+        return session
+
+    def _dispatch(self):
+        """Inicia trabalhos enquanto houver vaga (roda no loop)"""
+        jobs = []
+        with self._cond:
+            while self._running < self.max_workers:
+                job = self._next_job()
+                if job is None:
+                    break
+                self._running += 1
+                jobs.append(job)
+            if jobs:
+                self._cond.notify_all()  # Liberou espaço: acorda submit()
+        for route, func, args in jobs:
+            self.loop.create_task(self._run_job(route, func, args))
+        self._maybe_close()
+
+    async def _run_job(self, route, func, args):
+        try:
+            if asyncio.iscoroutinefunction(func):
+                await func(*args)
+            else:
+                await self.loop.run_in_executor(None, func, *args)
+        except Exception:
+            self.logger.exception("Erro não tratado no upload assíncrono")
+        finally:
+            with self._cond:
+                self._in_flight[route] -= 1
+                self._running -= 1
+                self._cond.notify_all()
+            self._dispatch()
+
+    def _maybe_close(self):
+        """Depois de stop(): encerra o loop quando não houver mais trabalho"""
+        with self._cond:
+            if not self._closing or self._running:
+                return
+            if any(jobs for route, jobs in self._queues.items()
+                   if route not in self._paused):
+                return
+            self._closing = False  # Encerramento agendado uma única vez
+        self.loop.create_task(self._close())
+
+    async def _close(self):
+        sessions, self._sessions = list(self._sessions.values()), {}
+        for session in sessions:
+            await session.close()
+        self.loop.stop()
+
+    def stop(self, wait=True):
+        """Encerra o loop depois de esvaziar as filas"""
+        with self._cond:
+            thread, self._thread = self._thread, None
+            if thread is None:
+                return
+            self._closing = True
+        self.loop.call_soon_threadsafe(self._maybe_close)
+        if wait:
+            thread.join()
+
+
+def create_upload_pool(settings):
+    """Pool de upload conforme upload_engine: threads (padrão) ou async"""
+    options = {
+        'queue_size': settings.getint('upload_queue_size', fallback=100),
+        'aging': settings.getfloat('schedule_aging', fallback=60.0),
+        'backlog_delay': settings.getfloat('schedule_backlog_delay',
+                                           fallback=600.0),
+        'size_limits': tuple(int(settings.getfloat(key, fallback=default)
+                                 * 1024 * 1024)
+                             for key, default in (('schedule_small_mb', 1),
+                                                  ('schedule_large_mb', 25))),
+    }
+    if settings.get('upload_engine', 'threads').strip().lower() == 'async':
+        if importlib.util.find_spec('aiohttp') is not None:
+            return AsyncUploadPool(
+                max_workers=settings.getint('async_max_concurrency', fallback=64),
+                **options)
+        logging.getLogger(__name__).warning(
+            "upload_engine = async requer o pacote aiohttp; usando threads")
+    return UploadWorkerPool(
+        max_workers=settings.getint('upload_workers', fallback=4), **options)
+
+
+class AsyncResponse:
+    """Resposta do aiohttp com a parte da interface de requests.Response
+    usada pelo uploader"""
+
+    def __init__(self, status_code, text, headers, elapsed):
+        self.status_code = status_code
+        self.text = text
+        self.headers = headers
+        self.elapsed = elapsed
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class RetryScheduler:
+    """Reenfileira uploads com falha quando o backoff de cada um vence"""
+
+    def __init__(self, store, dispatch, prefix, max_sleep=60.0):
+        self.store = store
+        self.dispatch = dispatch
+        self.prefix = prefix
+        self.max_sleep = max_sleep
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self.logger = logging.getLogger(__name__)
+
+    def start(self):
+        if self._thread is None:
+            self._stopped.clear()
+            self._thread = threading.Thread(
+                target=self._run, name='retry-scheduler', daemon=True)
+            self._thread.start()
+
+    def notify(self):
+        """Um novo retry foi agendado: recalcular o próximo vencimento"""
+        self._wake.set()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                now = time.time()
+                for file_path in self.store.due_retries(self.prefix, now):
+                    if self._stopped.is_set():
+                        return
+                    self.store.update(file_path, state='pending')
+                    self.dispatch(file_path)
+                next_at = self.store.next_retry_at(self.prefix)
+            except Exception:
+                self.logger.exception("Erro no agendador de novas tentativas")
+                next_at = None
+
+            if next_at is None:
+                timeout = self.max_sleep
+            else:
+                timeout = min(max(next_at - time.time(), 0.1), self.max_sleep)
+            self._wake.wait(timeout)
+            self._wake.clear()
+
+    def stop(self):
+        self._stopped.set()
+        self._wake.set()
+        thread, self._thread = self._thread, None
+        if thread and thread is not threading.current_thread():
+            thread.join(timeout=5)
+
+
+class TaskPoller:
+    """Acompanha as tarefas de consumo do Paperless com uma única consulta
+    por ciclo a /api/tasks/, independente de quantas estejam em andamento"""
+
+    TERMINAL_STATUS = {'SUCCESS', 'FAILURE', 'REVOKED'}
+
+    def __init__(self, session, base_url, store, prefix, on_result,
+                 min_interval=2.0, max_interval=30.0, timeout=3600.0,
+                 lookup_after=120.0, acknowledge=True):
+        self.session = session
+        self.base_url = base_url
+        self.store = store
+        self.prefix = prefix
+        self.on_result = on_result
+        self.min_interval = min_interval
+        self.max_interval = max(min_interval, max_interval)
+        self.timeout = timeout
+        self.lookup_after = lookup_after
+        self.acknowledge = acknowledge
+        self.interval = min_interval
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self.logger = logging.getLogger(__name__)
+
+    def start(self):
+        if self._thread is None:
+            self._stopped.clear()
+            self._thread = threading.Thread(
+                target=self._run, name='task-poller', daemon=True)
+            self._thread.start()
+
+    def notify(self):
+        """Nova tarefa registrada: voltar ao intervalo mínimo"""
+        self.interval = self.min_interval
+        self._wake.set()
+
+    def _fetch_tasks(self, params=None):
+        response = self.session.get(
+            f'{self.base_url}/api/tasks/', params=params, timeout=30)
+        response.raise_for_status()
+        data = response.json()
+        return data.get('results', []) if isinstance(data, dict) else data
+
+    def poll_once(self):
+        """Uma rodada de consulta; retorna quantas tarefas terminaram"""
+        # Arquivos de um lote compartilham a mesma tarefa
+        pending = {}
+        for row in self.store.consuming_tasks(self.prefix):
+            if row['task_id']:
+                pending.setdefault(row['task_id'], []).append(row)
+        if not pending:
+            return None
+
+        found = {task.get('task_id'): task for task in self._fetch_tasks()
+                 if task.get('task_id') in pending}
+
+        # Tarefas antigas fora da listagem (ex.: já reconhecidas na interface
+        # do Paperless) são consultadas individualmente, poucas por ciclo
+        now = time.time()
+        missing = [task_id for task_id, rows in pending.items()
+                   if task_id not in found
+                   and now - rows[0]['updated_at'] > self.lookup_after]
+        for task_id in missing[:5]:
+            for task in self._fetch_tasks({'task_id': task_id}):
+                if task.get('task_id') == task_id:
+                    found[task_id] = task
+
+        finished = 0
+        acknowledged = []
+        for task_id, rows in pending.items():
+            task = found.get(task_id)
+            if task is not None and task.get('status') in self.TERMINAL_STATUS:
+                for row in rows:
+                    self.on_result(row['path'], task)
+                finished += 1
+                if task.get('status') == 'SUCCESS' and task.get('id'):
+                    acknowledged.append(task['id'])
+            elif task is None and now - rows[0]['updated_at'] > self.timeout:
+                for row in rows:
+                    self.on_result(row['path'], None)
+                finished += 1
+
+        if self.acknowledge and acknowledged:
+            # Só as bem-sucedidas: falhas continuam visíveis no Paperless
+            self.session.post(f'{self.base_url}/api/acknowledge_tasks/',
+                              json={'tasks': acknowledged}, timeout=30)
+        return finished
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                finished = self.poll_once()
+            except (requests.exceptions.RequestException, ValueError) as e:
+                self.logger.warning("Falha ao consultar tarefas: %s", e)
+                finished = 0
+            except Exception:
+                self.logger.exception("Erro no acompanhamento de tarefas")
+                finished = 0
+
+            if finished is None:
+                # Nada em andamento: dormir até uma nova tarefa ser registrada
+                self.interval = self.min_interval
+                self._wake.wait(self.max_interval)
+            else:
+                # Intervalo adaptativo: rápido enquanto há progresso
+                if finished:
+                    self.interval = self.min_interval
+                else:
+                    self.interval = min(self.interval * 1.5,
+                                        self.max_interval)
+                self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def stop(self):
+        self._stopped.set()
+        self._wake.set()
+        thread, self._thread = self._thread, None
+        if thread and thread is not threading.current_thread():
+            thread.join(timeout=5)
+
+
+HealthResult = namedtuple('HealthResult', 'ok status detail checked_at')
+
+
+class HealthChecker:
+    """Sonda leve do servidor: GET /api/ só valida o token e lista as rotas
+    da API, sem consultar documentos. O resultado fica em cache por ttl"""
+
+    def __init__(self, session, base_url, endpoint='/api/', ttl=10.0,
+                 timeout=5.0):
+        self.session = session
+        self.url = base_url + endpoint
+        self.ttl = ttl
+        self.timeout = timeout
+        self._last = None
+        self._lock = threading.Lock()
+
+    def check(self, force=False):
+        """Retorna HealthResult; reaproveita o último resultado dentro do ttl"""
+        with self._lock:
+            last = self._last
+            if not force and last is not None and \
+                    time.monotonic() - last.checked_at < self.ttl:
+                return last
+            try:
+                response = self.session.get(self.url, timeout=self.timeout)
+                result = HealthResult(
+                    response.status_code == 200, response.status_code,
+                    f'HTTP {response.status_code}', time.monotonic())
+            except requests.exceptions.RequestException as e:
+                result = HealthResult(False, None, str(e), time.monotonic())
+            self._last = result
+            return result
+
+    @staticmethod
+    def is_down(result):
+        """Servidor inacessível ou com erro interno (401/403 não contam)"""
+        return result.status is None or result.status >= 500
+
+
+class HealthMonitor:
+    """Consulta o HealthChecker periodicamente e avisa quando o servidor cai
+    (on_down) e quando volta (on_up)"""
+
+    def __init__(self, checker, on_down, on_up, interval=30.0,
+                 down_interval=5.0):
+        self.checker = checker
+        self.on_down = on_down
+        self.on_up = on_up
+        self.interval = interval
+        self.down_interval = min(down_interval, interval)
+        self.down = False
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self.logger = logging.getLogger(__name__)
+
+    def start(self):
+        if self._thread is None:
+            self._stopped.clear()
+            self._thread = threading.Thread(
+                target=self._run, name='health-monitor', daemon=True)
+            self._thread.start()
+
+    def report_failure(self):
+        """Um upload falhou por conexão/5xx: verificar agora, sem esperar"""
+        self._wake.set()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                result = self.checker.check(force=True)
+                if HealthChecker.is_down(result) and not self.down:
+                    self.down = True
+                    self.on_down(result)
+                elif not HealthChecker.is_down(result) and self.down:
+                    self.down = False
+                    self.on_up(result)
+            except Exception:
+                self.logger.exception("Erro no monitor de saúde do servidor")
+            self._wake.wait(self.down_interval if self.down else self.interval)
+            self._wake.clear()
+
+    def stop(self):
+        self._stopped.set()
+        self._wake.set()
+        thread, self._thread = self._thread, None
+        if thread and thread is not threading.current_thread():
+            thread.join(timeout=5)
+
+
+def parse_retry_after(value):
+    """Converte o cabeçalho Retry-After (segundos ou data HTTP) em segundos"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+class PathMatcher:
+    """Filtro de caminhos com globs de inclusão e exclusão, cada lista
+    compilada uma única vez num só regex.
+
+    Inclusões casam com o nome do arquivo. Exclusões sem '/' casam com o
+    nome do arquivo ou de qualquer pasta do caminho (ex.: processados,
+    .git); com '/', com o caminho relativo inteiro."""
+
+    DEFAULT_INCLUDE = ('*.pdf, *.png, *.jpg, *.jpeg, *.tiff, *.tif, *.txt, '
+                       '*.doc, *.docx')
+    # Temporários de Office/LibreOffice, downloads e cópias em andamento
+    DEFAULT_EXCLUDE = '~$*, .~lock*, .*, *.part, *.partial, *.crdownload, *.tmp'
+
+    def __init__(self, include=(), exclude=()):
+        self.include = list(include)
+        self.exclude = list(exclude)
+        self._include = self._compile(self.include)
+        self._exclude_name = self._compile(
+            [p for p in self.exclude if '/' not in p])
+        self._exclude_path = self._compile(
+            [p for p in self.exclude if '/' in p])
+
+    @classmethod
+    def from_settings(cls, settings):
+        def patterns(key, default):
+            value = settings.get(key, default, raw=True)
+            return [p.strip() for p in value.split(',') if p.strip()]
+        # processados/ nunca é enviado, qualquer que seja a configuração
+        return cls(patterns('include_patterns', cls.DEFAULT_INCLUDE),
+                   patterns('exclude_patterns', cls.DEFAULT_EXCLUDE)
+                   + ['processados'])
+
+    @staticmethod
+    def _compile(patterns):
+        if not patterns:
+            return None
+        return re.compile('|'.join(fnmatch.translate(p) for p in patterns),
+                          re.IGNORECASE)
+
+    def includes(self, name):
+        """O nome do arquivo casa com algum glob de inclusão?"""
+        return self._include is None or self._include.match(name) is not None
+
+    def excludes(self, relative_path):
+        """O caminho (relativo, com '/') casa com algum glob de exclusão?"""
+        if self._exclude_path and self._exclude_path.match(relative_path):
+            return True
+        match = self._exclude_name.match if self._exclude_name else None
+        return match is not None and any(
+            match(part) for part in relative_path.split('/'))
+
+
+class FileStabilityTracker:
+    """Acompanha arquivos em escrita num único loop até ficarem estáveis"""
+
+    def __init__(self, on_ready, on_timeout=None, initial_interval=0.25,
+                 max_interval=2.0, min_quiet=2.0, max_wait=600.0):
+        self.on_ready = on_ready
+        self.on_timeout = on_timeout
+        self.initial_interval = initial_interval
+        self.max_interval = max(initial_interval, max_interval)
+        self.min_quiet = min_quiet
+        self.max_wait = max_wait
+        self._pending = {}  # caminho -> estado do acompanhamento
+        self._heap = []  # (vencimento, seq, caminho, versão)
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopped = False
+        self.coalesced = 0  # Eventos absorvidos por arquivos já pendentes
+        self.logger = logging.getLogger(__name__)
+
+    @staticmethod
+    def _stat(file_path):
+        try:
+            st = os.stat(file_path)
+        except OSError:
+            return None
+        return st.st_size, st.st_mtime_ns
+
+    def track(self, file_path):
+        """Começa a acompanhar o arquivo ou reinicia o backoff se já pendente"""
+        current = self._stat(file_path)
+        now = time.monotonic()
+        with self._cond:
+            entry = self._pending.get(file_path)
+            if entry is None:
+                entry = {'first_seen': now, 'version': 0, 'closed': False}
+                self._pending[file_path] = entry
+            entry['stat'] = current
+            entry['stable_since'] = now
+            entry['interval'] = self.initial_interval
+            self._schedule(file_path, entry, now + self.initial_interval)
+
+    def touch(self, file_path):
+        """Novo evento (created/modified) de um arquivo já acompanhado: é
+        absorvido sem stat nem reagendamento, pois a próxima verificação
+        já compara tamanho/mtime. Retorna False se o arquivo não é
+        acompanhado"""
+        with self._cond:
+            entry = self._pending.get(file_path)
+            if entry is None:
+                return False
+            entry['stable_since'] = time.monotonic()
+            self.coalesced += 1
+            return True
+
+    def rename(self, src_path, dest_path):
+        """Arquivo renomeado antes de estabilizar (nome temporário -> final):
+        o acompanhamento continua no novo nome, sem recomeçar a espera.
+        Retorna False se src_path não era acompanhado"""
+        with self._cond:
+            entry = self._pending.pop(src_path, None)
+            if entry is None:
+                return False
+            self._pending[dest_path] = entry
+            self.coalesced += 1
+            self._schedule(dest_path, entry,
+                           time.monotonic() + self.initial_interval)
+            return True
+
+    def mark_closed(self, file_path):
+        """O escritor fechou o arquivo (close-write do inotify): verificar já"""
+        with self._cond:
+            entry = self._pending.get(file_path)
+            if entry is None:
+                return
+            entry['closed'] = True
+            self._schedule(file_path, entry, time.monotonic())
+
+    def discard(self, file_path):
+        """Deixa de acompanhar o arquivo (ex.: removido ou renomeado)"""
+        with self._cond:
+            self._pending.pop(file_path, None)
+
+    def is_tracking(self, file_path):
+        with self._cond:
+            return file_path in self._pending
+
+    def pending_count(self):
+        with self._cond:
+            return len(self._pending)
+
+    def pending_paths(self):
+        with self._cond:
+            return list(self._pending)
+
+    def _schedule(self, file_path, entry, due):
+        # Chamado com o lock adquirido; versões antigas no heap são ignoradas
+        entry['version'] += 1
+        heapq.heappush(
+            self._heap, (due, next(self._seq), file_path, entry['version']))
+        if self._thread is None:
+            self._stopped = False
+            self._thread = threading.Thread(
+                target=self._run, name='stability-tracker', daemon=True)
+            self._thread.start()
+        self._cond.notify()
+
+    def _pop_due(self):
+        """Aguarda e retorna os arquivos cuja verificação venceu"""
+        with self._cond:
+            while not self._stopped:
+                now = time.monotonic()
+                if self._heap and self._heap[0][0] <= now:
+                    break
+                timeout = self._heap[0][0] - now if self._heap else None
+                self._cond.wait(timeout)
+            if self._stopped:
+                return None
+
+            due = []
+            now = time.monotonic()
+            while self._heap and self._heap[0][0] <= now:
+                _, _, file_path, version = heapq.heappop(self._heap)
+                entry = self._pending.get(file_path)
+                if entry is not None and entry['version'] == version:
+                    due.append((file_path, version))
+            return due
+
+    def _run(self):
+        while True:
+            due = self._pop_due()
+            if due is None:
+                return
+            for file_path, version in due:
+                try:
+                    self._check(file_path, version)
+                except Exception:
+                    self.logger.exception(
+                        "Erro ao verificar estabilidade de %s", file_path)
+
+    def _check(self, file_path, version):
+        current = self._stat(file_path)
+        now = time.monotonic()
+        ready = timed_out = False
+        with self._cond:
+            entry = self._pending.get(file_path)
+            if entry is None or entry['version'] != version:
+                return
+            if current is None:
+                # Arquivo sumiu (removido ou renomeado antes de estabilizar)
+                del self._pending[file_path]
+                return
+
+            size = current[0]
+            changed = current != entry['stat']
+            if changed:
+                # Ainda em escrita: backoff exponencial até o teto
+                entry['stat'] = current
+                entry['stable_since'] = now
+                entry['interval'] = min(
+                    entry['interval'] * 2, self.max_interval)
+            if size > 0:
+                # Só o silêncio observado aqui conta: o mtime vem do relógio
+                # do servidor (SMB/NFS) ou é preservado na cópia (cp -p,
+                # rsync, unzip) e não prova que a escrita acabou
+                quiet = now - entry['stable_since']
+                ready = entry['closed'] or (
+                    not changed and quiet >= self.min_quiet)
+            entry['closed'] = False
+
+            if not ready and not entry.get('timed_out') and \
+                    now - entry['first_seen'] >= self.max_wait:
+                # Avisa uma vez e continua verificando no intervalo máximo:
+                # no polling de compartilhamentos, escrever dentro de um
+                # arquivo não gera evento que o traga de volta
+                timed_out = entry['timed_out'] = True
+                entry['interval'] = self.max_interval
+
+            if ready:
+                del self._pending[file_path]
+            else:
+                delay = entry['interval']
+                if not changed and size > 0:
+                    # Estável, mas ainda sem o silêncio mínimo
+                    delay = min(delay, max(
+                        self.min_quiet - (now - entry['stable_since']), 0.05))
+                self._schedule(file_path, entry, now + delay)
+
+        if ready:
+            self.on_ready(file_path)
+        elif timed_out and self.on_timeout:
+            self.on_timeout(file_path)
+
+    def stop(self):
+        """Encerra o loop e descarta os arquivos pendentes"""
+        with self._cond:
+            self._stopped = True
+            self._pending.clear()
+            self._heap.clear()
+            thread, self._thread = self._thread, None
+            self._cond.notify_all()
+        if thread and thread is not threading.current_thread():
+            thread.join(timeout=5)
+
+
+class ArchivePolicy:
+    """Destino dos arquivos já enviados: move (padrão), hardlink (mantém o
+    original), delete ou zip, em subpastas por data para que nenhum
+    diretório de arquivo cresça sem limite"""
+
+    MODES = ('move', 'hardlink', 'delete', 'zip')
+
+    def __init__(self, folder_path, mode='move', archive_dir=None,
+                 shard='%Y/%m'):
+        if mode not in self.MODES:
+            raise ValueError(f"archive_mode inválido: {mode}")
+        self.folder_path = folder_path
+        self.mode = mode
+        self.archive_dir = archive_dir
+        self.shard = shard
+        self._dirs = set()  # Diretórios já criados (evita makedirs por arquivo)
+        self._zip_lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls, folder_path, settings):
+        return cls(folder_path,
+                   mode=settings.get('archive_mode', 'move').strip().lower(),
+                   archive_dir=settings.get('archive_dir', '').strip() or None,
+                   shard=settings.get('archive_shard', '%Y/%m', raw=True).strip())
+
+    def root_for(self, file_path):
+        """Raiz do arquivo morto: processados/ ao lado do arquivo ou, com
+        archive_dir, a mesma subpasta relativa dentro dele"""
+        directory = os.path.dirname(file_path)
+        if self.archive_dir is None:
+            return os.path.join(directory, 'processados')
+        relative = os.path.relpath(directory, self.folder_path)
+        return os.path.normpath(os.path.join(self.archive_dir, relative))
+
+    def is_root(self, directory):
+        if self.archive_dir is None:
+            return os.path.basename(directory) == 'processados'
+        return os.path.normpath(directory) == os.path.normpath(self.archive_dir)
+
+    def contains(self, file_path):
+        """Arquivos dentro do arquivo morto nunca são enviados"""
+        if self.archive_dir is None:
+            return False
+        return os.path.normpath(file_path).startswith(
+            os.path.join(os.path.normpath(self.archive_dir), ''))
+
+    def archive(self, file_path):
+        """Arquiva o arquivo; retorna o novo caminho (None no modo delete)"""
+        if self.mode == 'delete':
+            os.unlink(file_path)
+            return None
+        directory = self.root_for(file_path)
+        shard = datetime.now().strftime(self.shard) if self.shard else ''
+        if self.mode == 'zip':
+            return self._add_to_zip(file_path, directory, shard)
+        if shard:
+            directory = os.path.join(directory, *shard.split('/'))
+        return self._place(file_path, directory,
+                           keep_source=self.mode == 'hardlink')
+
+    def forget_dir(self, directory):
+        """Diretório removido pela limpeza: recriar no próximo uso"""
+        self._dirs.discard(directory)
+
+    def _ensure_dir(self, directory):
+        if directory not in self._dirs:
+            os.makedirs(directory, exist_ok=True)
+            self._dirs.add(directory)
+
+    @staticmethod
+    def _candidates(name):
+        """Nome original e, se ocupado, variações com data/hora"""
+        yield name
+        stem, ext = os.path.splitext(name)
+        stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        yield f"{stem}_{stamp}{ext}"
+        for i in itertools.count(1):
+            yield f"{stem}_{stamp}_{i}{ext}"
+
+    def _place(self, src, directory, keep_source):
+        self._ensure_dir(directory)
+        for name in self._candidates(os.path.basename(src)):
+            dst = os.path.join(directory, name)
+            try:
+                self._link_or_copy(src, dst)
+            except FileExistsError:
+                continue  # Sem os.path.exists: a criação já é exclusiva
+            except FileNotFoundError:
+                if not os.path.exists(src):
+                    raise
+                # Diretório removido pela limpeza de retenção
+                self.forget_dir(directory)
+                self._ensure_dir(directory)
+                self._link_or_copy(src, dst)
+            break
+        if not keep_source:
+            os.unlink(src)
+        return dst
+
+    def _link_or_copy(self, src, dst):
+        try:
+            os.link(src, dst)  # Atômico e nunca sobrescreve o destino
+        except (FileExistsError, FileNotFoundError):
+            raise
+        except OSError:
+            # Outro dispositivo (EXDEV) ou sistema de arquivos sem hardlink
+            self._copy(src, dst)
+
+    @staticmethod
+    def _copy(src, dst):
+        """Cópia durável: o original só é apagado depois do fsync"""
+        with open(src, 'rb') as fsrc, open(dst, 'xb') as fdst:
+            try:
+                shutil.copyfileobj(fsrc, fdst, 1024 * 1024)
+                fdst.flush()
+                os.fsync(fdst.fileno())
+            except BaseException:
+                fdst.close()
+                os.unlink(dst)
+                raise
+        shutil.copystat(src, dst)
+
+    def _add_to_zip(self, src, directory, shard):
+        """Acrescenta ao zip do período (ex.: processados/2026/10.zip)"""
+        if shard:
+            parts = shard.split('/')
+            directory = os.path.join(directory, *parts[:-1])
+            zip_path = os.path.join(directory, parts[-1] + '.zip')
+        else:
+            zip_path = os.path.join(directory, 'processados.zip')
+        with self._zip_lock:
+            self._ensure_dir(directory)
+            with zipfile.ZipFile(zip_path, 'a', zipfile.ZIP_DEFLATED) as zf:
+                for arcname in self._candidates(os.path.basename(src)):
+                    if arcname not in zf.NameToInfo:
+                        break
+                zf.write(src, arcname)
+            with open(zip_path, 'rb+') as f:
+                os.fsync(f.fileno())
+        os.unlink(src)
+        return zip_path
+
+
+class ArchiveSweeper:
+    """Apaga em segundo plano o que foi arquivado há mais de retention_days"""
+
+    def __init__(self, store, policy, prefix, retention_days, interval=3600.0,
+                 log=None):
+        self.store = store
+        self.policy = policy
+        self.prefix = prefix
+        self.retention = retention_days * 86400
+        self.interval = interval
+        self.log = log or (lambda message: None)
+        self._stopped = threading.Event()
+        self._thread = None
+        self.logger = logging.getLogger(__name__)
+
+    def start(self):
+        if self._thread is None:
+            self._stopped.clear()
+            self._thread = threading.Thread(
+                target=self._run, name='archive-sweeper', daemon=True)
+            self._thread.start()
+
+    def sweep(self):
+        """Uma passada completa; retorna quantos arquivos foram apagados"""
+        cutoff = time.time() - self.retention
+        removed = 0
+        while not self._stopped.is_set():
+            rows = self.store.archived_before(self.prefix, cutoff)
+            if not rows:
+                break
+            for archived_path in dict.fromkeys(row['archived_path'] for row in rows):
+                try:
+                    mtime = os.path.getmtime(archived_path)
+                except FileNotFoundError:
+                    self.store.forget_archive(archived_path)
+                    continue
+                if archived_path.endswith('.zip') and mtime >= cutoff:
+                    # Zip do período ainda recebendo arquivos: vence depois
+                    self.store.set_archived_at(archived_path, mtime)
+                    continue
+                os.unlink(archived_path)
+                self.store.forget_archive(archived_path)
+                self._prune_dirs(os.path.dirname(archived_path))
+                removed += 1
+        return removed
+
+    def _prune_dirs(self, directory):
+        """Remove subpastas de data que ficaram vazias, até a raiz"""
+        while not self.policy.is_root(directory):
+            try:
+                os.rmdir(directory)  # Falha (e para) se não estiver vazia
+            except OSError:
+                return
+            self.policy.forget_dir(directory)
+            directory = os.path.dirname(directory)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                removed = self.sweep()
+                if removed:
+                    self.log(f"🧹 Retenção: {removed} arquivo(s) antigo(s) "
+                             f"removido(s) do arquivo morto")
+            except Exception:
+                self.logger.exception("Erro na limpeza do arquivo morto")
+            self._stopped.wait(self.interval)
+
+    def stop(self):
+        self._stopped.set()
+        thread, self._thread = self._thread, None
+        if thread and thread is not threading.current_thread():
+            thread.join(timeout=5)
+
+
+# Sistemas de arquivos de rede: gravações feitas por outras máquinas não
+# geram eventos nativos (inotify/FSEvents/ReadDirectoryChangesW)
+NETWORK_FILESYSTEMS = {
+    'nfs', 'nfs4', 'cifs', 'smb3', 'smbfs', 'afs', '9p', 'ceph', 'glusterfs',
+    'davfs', 'fuse.sshfs', 'fuse.rclone', 'fuse.glusterfs', 'fuse.davfs2'}
+
+
+def is_network_mount(path):
+    """True se a pasta estiver num compartilhamento de rede (SMB/NFS/...)"""
+    path = os.path.realpath(path)
+    if sys.platform == 'win32':
+        if path.startswith('\\\\'):  # Caminho UNC
+            return True
+        import ctypes
+        drive = os.path.splitdrive(path)[0] + '\\'
+        return ctypes.windll.kernel32.GetDriveTypeW(drive) == 4  # DRIVE_REMOTE
+    try:
+        with open('/proc/mounts', encoding='utf-8') as f:
+            mounts = [line.split()[1:3] for line in f]
+    except OSError:
+        return False  # Sem /proc (ex.: macOS): use observer = polling
+    best, fstype = '', ''
+    for mount_point, kind in mounts:
+        # Espaços e afins vêm escapados em octal (ex.: \040)
+        mount_point = re.sub(r'\\([0-7]{3})',
+                             lambda m: chr(int(m.group(1), 8)), mount_point)
+        inside = path == mount_point or \
+            path.startswith(os.path.join(mount_point, ''))
+        if inside and len(mount_point) >= len(best):
+            best, fstype = mount_point, kind
+    return fstype in NETWORK_FILESYSTEMS
+
+
+DirSnapshot = namedtuple('DirSnapshot', 'mtime_ns children')
+PollWatch = namedtuple('PollWatch', 'handler path recursive exclude snapshots')
+
+
+class IncrementalPollingObserver:
+    """Substituto do Observer do watchdog para compartilhamentos de rede.
+
+    Guarda, por diretório, o mtime e os stats dos filhos (None para
+    subpastas). A cada ciclo faz um stat por diretório e só relista os que
+    mudaram; subárvores excluídas (processados/) nem são percorridas. Uma
+    escrita no conteúdo de um arquivo não muda o mtime da pasta, mas isso
+    não importa: o FileStabilityTracker acompanha sozinho os arquivos novos
+    até ficarem estáveis."""
+
+    def __init__(self, interval=5.0, log=None):
+        self.interval = interval
+        self.log = log or (lambda message: None)
+        self._watches = []
+        self._stopped = threading.Event()
+        self._thread = None
+        self.stats = {'cycles': 0, 'dir_stats': 0, 'rescans': 0}
+        self.logger = logging.getLogger(__name__)
+
+    def schedule(self, event_handler, path, recursive=False):
+        exclude = getattr(event_handler, 'is_excluded', None) or \
+            (lambda file_path: False)
+        self._watches.append(PollWatch(event_handler, os.path.abspath(path),
+                                       recursive, exclude, {}))
+
+    def start(self):
+        if self._thread is None:
+            self._stopped.clear()
+            self._thread = threading.Thread(
+                target=self._run, name='polling-observer', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def join(self, timeout=None):
+        thread = self._thread
+        if thread and thread is not threading.current_thread():
+            thread.join(timeout)
+
+    def is_alive(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def _list(self, watch, directory):
+        """(DirSnapshot, recente) do diretório; None se não existir mais.
+        O mtime é lido antes da listagem: uma criação no meio dela muda o
+        mtime e a pasta é relistada no próximo ciclo"""
+        try:
+            mtime_ns = os.stat(directory).st_mtime_ns
+            children = {}
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if watch.exclude(entry.path):
+                        continue
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            children[entry.name] = None
+                            continue
+                        st = entry.stat(follow_symlinks=False)
+                    except OSError:
+                        continue  # Removido durante a listagem
+                    children[entry.name] = (st.st_ino, st.st_size,
+                                            st.st_mtime_ns)
+        except OSError:
+            return None
+        self.stats['rescans'] += 1
+        # Criações no mesmo "tick" do relógio, logo após a listagem, não
+        # mudariam o mtime: pastas alteradas há pouco são relistadas de novo
+        recent = abs(time.time_ns() - mtime_ns) < 2 * 10 ** 9
+        return DirSnapshot(mtime_ns, children), recent
+
+    def _add_tree(self, watch, directory, created=None, dirty=None):
+        """Lista a subárvore e guarda os snapshots; com created, registra os
+        arquivos encontrados como novos"""
+        pending = [directory]
+        while pending:
+            current = pending.pop()
+            listed = self._list(watch, current)
+            if listed is None:
+                continue
+            snapshot, recent = listed
+            watch.snapshots[current] = snapshot
+            if recent and dirty is not None:
+                dirty.add(current)
+            for name, info in snapshot.children.items():
+                path = os.path.join(current, name)
+                if info is None:
+                    if watch.recursive:
+                        pending.append(path)
+                elif created is not None:
+                    created[path] = info
+
+    def _drop_tree(self, watch, directory, deleted):
+        """Esquece a subárvore removida, registrando seus arquivos"""
+        prefix = os.path.join(directory, '')
+        for path in [p for p in watch.snapshots
+                     if p == directory or p.startswith(prefix)]:
+            snapshot = watch.snapshots.pop(path)
+            for name, info in snapshot.children.items():
+                if info is not None:
+                    deleted[os.path.join(path, name)] = info
+
+    def poll(self, watch, dirty):
+        """Um ciclo: retorna os eventos do watchdog, na ordem de despacho"""
+        created, deleted, modified = {}, {}, []
+        still_dirty = set()
+        for directory in sorted(watch.snapshots):
+            old = watch.snapshots.get(directory)
+            if old is None:
+                continue  # Removido junto com a pasta pai neste ciclo
+            try:
+                mtime_ns = os.stat(directory).st_mtime_ns
+            except OSError:
+                continue  # A pasta pai também mudou e trata a remoção
+            self.stats['dir_stats'] += 1
+            if mtime_ns == old.mtime_ns and directory not in dirty:
+                continue
+            listed = self._list(watch, directory)
+            if listed is None:
+                continue
+            snapshot, recent = listed
+            watch.snapshots[directory] = snapshot
+            if recent:
+                still_dirty.add(directory)
+            for name in old.children.keys() - snapshot.children.keys():
+                path = os.path.join(directory, name)
+                if old.children[name] is None:
+                    self._drop_tree(watch, path, deleted)
+                else:
+                    deleted[path] = old.children[name]
+            for name, info in snapshot.children.items():
+                path = os.path.join(directory, name)
+                before = old.children.get(name, False)
+                if info is None:
+                    if before is not None:
+                        if before is not False:
+                            deleted[path] = before  # Arquivo virou pasta
+                        if watch.recursive:
+                            self._add_tree(watch, path, created, still_dirty)
+                elif before is None or before is False or before[0] != info[0]:
+                    if before is None:
+                        self._drop_tree(watch, path, deleted)  # Pasta virou arquivo
+                    elif before is not False:
+                        deleted[path] = before  # Substituído (outro inode)
+                    created[path] = info
+                elif before[1:] != info[1:]:
+                    modified.append(path)
+        dirty.clear()
+        dirty.update(still_dirty)
+
+        # Mesmo inode sumindo de um lugar e aparecendo em outro: renomeação
+        by_inode = {info[0]: path for path, info in created.items() if info[0]}
+        events = []
+        for src_path, info in deleted.items():
+            dest_path = by_inode.get(info[0]) if info[0] else None
+            if dest_path is not None and dest_path != src_path:
+                created.pop(dest_path)
+                events.append(FileMovedEvent(src_path, dest_path))
+            else:
+                events.append(FileDeletedEvent(src_path))
+        events.extend(FileCreatedEvent(path) for path in created)
+        events.extend(FileModifiedEvent(path) for path in modified)
+        return events
+
+    def _run(self):
+        dirty = {}
+        for watch in self._watches:
+            started = time.monotonic()
+            dirty[watch.path] = set()
+            self._add_tree(watch, watch.path, dirty=dirty[watch.path])
+            files = sum(1 for snapshot in watch.snapshots.values()
+                        for info in snapshot.children.values() if info)
+            self.log(f"🔁 Polling incremental em {watch.path}: "
+                     f"{len(watch.snapshots)} pasta(s), {files} arquivo(s) "
+                     f"indexados em {time.monotonic() - started:.1f}s")
+        while not self._stopped.wait(self.interval):
+            self.stats['cycles'] += 1
+            for watch in self._watches:
+                try:
+                    events = self.poll(watch, dirty[watch.path])
+                except Exception:
+                    self.logger.exception("Erro no polling de %s", watch.path)
+                    continue
+                for event in events:
+                    try:
+                        watch.handler.dispatch(event)
+                    except Exception:
+                        self.logger.exception("Erro ao tratar %r", event)
+
+
+def create_observer(folder, settings, log=None):
+    """Observer da pasta conforme a opção observer: native (eventos do
+    sistema), polling (IncrementalPollingObserver) ou auto, que usa polling
+    quando a pasta está num compartilhamento de rede"""
+    mode = settings.get('observer', 'auto').strip().lower()
+    if mode == 'auto':
+        mode = 'polling' if is_network_mount(folder) else 'native'
+    if mode == 'polling':
+        return IncrementalPollingObserver(
+            interval=settings.getfloat('poll_interval', fallback=5.0), log=log)
+    if mode != 'native':
+        raise ValueError(f"observer inválido: {mode}")
+    return Observer()
 
 
 class PaperlessUploader(FileSystemEventHandler):
-    def __init__(self, paperless_url, api_token, folder_path, log_callback=None):
+    # Respostas que indicam falha temporária (vale tentar de novo)
+    RETRYABLE_STATUS = {408, 425, 429, 500, 502, 503, 504}
+    # Respostas em que o servidor pede para reduzir o ritmo
+    THROTTLE_STATUS = {429, 503}
+
+    def __init__(self, paperless_url, api_token, folder_path, log_callback=None,
+                 settings=None, pool=None, store=None, route_name='default',
+                 limiter=None, optimizer=None, metrics=None):
         self.paperless_url = paperless_url.rstrip('/')
         self.api_token = api_token
         self.folder_path = folder_path
         self.log_callback = log_callback
-        self.processed_files = set()  # Controle de arquivos já processados
+        if settings is None:
+            settings = ConfigParser()['DEFAULT']
+        self.settings = settings
+        self.store = store  # Estado persistente (aberto em load_processed_files)
+        self.owns_store = store is None
         self.processing_files = set()  # Controle de arquivos sendo processados
+        self._processing_lock = threading.Lock()
+
+        # Pool de upload: os handlers do watchdog apenas enfileiram caminhos
+        self.owns_pool = pool is None
+        if pool is None:
+            pool = create_upload_pool(settings)
+        self.pool = pool
+        self.route_name = route_name
+        self.max_concurrency = min(
+            settings.getint('max_concurrency', fallback=pool.max_workers),
+            pool.max_workers)
+        pool.add_route(route_name, max_concurrency=self.max_concurrency,
+                       queue_size=settings.getint('upload_queue_size',
+                                                  fallback=pool.queue_size))
         self.headers = {
             'Authorization': f'Token {api_token}',
             'User-Agent': 'PaperlessAutoUploader/1.0'
         }
-
-        # Configurar logging
-        log_file = os.path.join(os.path.dirname(
-            __file__), 'paperless_uploader.log')
-        logging.basicConfig(
-            level=logging.INFO,
-            format='%(asctime)s - %(levelname)s - %(message)s',
-            handlers=[
-                logging.FileHandler(log_file, encoding='utf-8'),
-                logging.StreamHandler()
-            ]
-        )
+        # Arquivos novos só são enfileirados quando param de ser escritos
+        self.tracker = FileStabilityTracker(
+            on_ready=self.enqueue_file,
+            on_timeout=self._on_stability_timeout,
+            initial_interval=settings.getfloat(
+                'stability_initial_interval', fallback=0.25),
+            max_interval=settings.getfloat(
+                'stability_max_interval', fallback=2.0),
+            min_quiet=settings.getfloat('stability_min_quiet', fallback=2.0),
+            max_wait=settings.getfloat('stability_timeout', fallback=600.0))
+        # Sessão compartilhada por todos os workers: reaproveita TCP/TLS
+        self.http_pool_size = settings.getint(
+            'http_pool_size', fallback=self.max_concurrency)
+        self.session = create_session(self.headers,
+                                      pool_size=self.http_pool_size)
+
+        # Configurar logging (assíncrono, uma vez por processo)
+        setup_logging(settings)
         self.logger = logging.getLogger(__name__)
 
+        # Metadados definidos no envio a partir do nome/caminho do arquivo
+        self.metadata_rules = load_metadata_rules(
+            getattr(settings, 'parser', ConfigParser()), route_name)
+        self.lookups = PaperlessLookupCache(
+            self.session, self.paperless_url,
+            ttl=settings.getfloat('lookup_cache_ttl', fallback=3600.0))
+        # Arquivos pequenos em sequência (uma página por arquivo) num só documento
+        batch_rules = load_batch_rules(
+            getattr(settings, 'parser', ConfigParser()), route_name)
+        self.coalescer = BatchCoalescer(batch_rules, self._submit_batch) \
+            if batch_rules else None
+        # Prioridade na fila de upload por pasta/caminho
+        self.priority_rules = load_priority_rules(
+            getattr(settings, 'parser', ConfigParser()), route_name)
+
+        # Limite global de banda (KB/s); compartilhado quando passado de fora
+        if limiter is None:
+            limit_kb = settings.getfloat('bandwidth_limit_kb', fallback=0)
+            limiter = TokenBucket(limit_kb * 1024) if limit_kb > 0 else None
+        self.limiter = limiter
+        # Otimização de imagens antes do envio (opcional, pool de processos)
+        self.owns_optimizer = optimizer is None
+        if optimizer is None:
+            optimizer = ImageOptimizer.from_settings(settings)
+        self.optimizer = optimizer
+        if optimizer is not None and not optimizer.available:
+            self.log_message("⚠️ Pillow não instalado: otimização de imagens desativada")
+        # Progresso por arquivo: callable(caminho, bytes_enviados, total)
+        self.progress_callback = None
+        self.progress_log_min_size = settings.getint(
+            'progress_log_min_size', fallback=10 * 1024 * 1024)
+
+        # Métricas (latências, bytes, status); exportadas se configurado
+        self.owns_metrics = metrics is None
+        self.metrics = metrics or Metrics()
+        self.exporter = None
+        if self.owns_metrics:
+            self.exporter = MetricsExporter.from_settings(self.metrics, settings)
+        self.metrics.gauge('queue_depth', lambda: self.pool.pending(route_name),
+                           route=route_name)
+        self.metrics.gauge('in_flight_uploads',
+                           lambda: self.pool.in_flight(route_name),
+                           route=route_name)
+        self.metrics.gauge('stability_pending_files',
+                           lambda: self.tracker.pending_count(), route=route_name)
+        if self.pool.metrics is None:
+            self.pool.metrics = self.metrics
+        for size_class in pool.SIZE_CLASSES:
+            for source in pool.SOURCES:
+                self.metrics.gauge(
+                    'queue_depth_by_class',
+                    lambda key=(size_class, source):
+                        self.pool.pending_by_class(route_name)[key],
+                    route=route_name, size_class=size_class, source=source)
+        self._detected_at = {}  # caminho -> instante da detecção
+        self._enqueued_at = {}  # caminho -> início da contagem de latência
+
+        # Verificar no servidor se o checksum já existe antes de enviar
+        self.check_server_duplicates = settings.getboolean(
+            'check_server_duplicates', fallback=False)
+
+        # Novas tentativas com backoff exponencial e "dead letter"
+        self.retry_max_attempts = settings.getint(
+            'retry_max_attempts', fallback=8)
+        self.retry_base_delay = settings.getfloat(
+            'retry_base_delay', fallback=30.0)
+        self.retry_max_delay = settings.getfloat(
+            'retry_max_delay', fallback=3600.0)
+        self._throttle_until = 0.0  # Pausa global pedida via 429/503
+
         # Carregar lista de arquivos já processados
         self.load_processed_files()
 
-    def load_processed_files(self):
-        """Carrega lista de arquivos já processados"""
-        try:
-            processed_file = os.path.join(
-                os.path.dirname(__file__), 'processed_files.txt')
-            if os.path.exists(processed_file):
-                with open(processed_file, 'r', encoding='utf-8') as f:
-                    for line in f:
-                        self.processed_files.add(line.strip())
-                self.log_message(
-                    f"📋 Carregados {len(self.processed_files)} arquivos já processados")
-        except Exception as e:
-            self.log_message(
-                f"⚠️ Erro ao carregar lista de processados: {str(e)}")
+        # Encerramento gracioso (drain) e retomada a partir do checkpoint
+        self._draining = threading.Event()
+        self.shutdown_timeout = settings.getfloat('shutdown_timeout',
+                                                  fallback=30.0)
+        # Varreduras em andamento (podem ser várias: retomada do checkpoint
+        # e a dos arquivos existentes) e pastas que as interrompidas não
+        # listaram, para o checkpoint
+        self._scans = {}
+        self._interrupted_dirs = []
+        self._scan_lock = threading.Lock()
+
+        # Destino dos arquivos enviados e limpeza por retenção
+        self.archive = ArchivePolicy.from_settings(folder_path, settings)
+        # Globs de inclusão/exclusão, compilados uma vez
+        self.matcher = PathMatcher.from_settings(settings)
+        self._folder_prefixes = tuple(dict.fromkeys(
+            os.path.join(path, '') for path in
+            (folder_path, os.path.abspath(folder_path))))
+        self.archive_sweeper = None
+        retention_days = settings.getfloat('archive_retention_days', fallback=0)
+        if retention_days > 0:
+            self.archive_sweeper = ArchiveSweeper(
+                self.store, self.archive, os.path.join(folder_path, ''),
+                retention_days, log=self.log_message,
+                interval=settings.getfloat('archive_sweep_interval',
+                                           fallback=3600.0))
+            self.archive_sweeper.start()
+
+        # Retries persistidos sobrevivem a reinícios do processo
+        self.retry_scheduler = RetryScheduler(
+            self.store, lambda path: self.enqueue_file(path, retry=True),
+            prefix=os.path.join(folder_path, ''))
+        self.retry_scheduler.start()
+
+        # Arquivo só é concluído quando a tarefa de consumo do Paperless termina
+        self.task_poller = None
+        if settings.getboolean('task_tracking', fallback=True):
+            self.task_poller = TaskPoller(
+                self.session, self.paperless_url, self.store,
+                prefix=os.path.join(folder_path, ''),
+                on_result=self._on_task_result,
+                min_interval=settings.getfloat(
+                    'task_poll_min_interval', fallback=2.0),
+                max_interval=settings.getfloat(
+                    'task_poll_max_interval', fallback=30.0),
+                timeout=settings.getfloat('task_timeout', fallback=3600.0),
+                acknowledge=settings.getboolean(
+                    'acknowledge_tasks', fallback=True))
+            self.task_poller.start()
+
+        # Sonda leve do servidor; fora do ar, a rota é pausada no pool e os
+        # arquivos esperam na fila em vez de falharem um a um
+        self.health = HealthChecker(
+            self.session, self.paperless_url,
+            ttl=settings.getfloat('health_cache_ttl', fallback=10.0))
+        self.health_monitor = None
+        health_interval = settings.getfloat('health_interval', fallback=30.0)
+        if health_interval > 0:
+            self.health_monitor = HealthMonitor(
+                self.health, self._on_server_down, self._on_server_up,
+                interval=health_interval,
+                down_interval=settings.getfloat(
+                    'health_down_interval', fallback=5.0))
+            self.health_monitor.start()
+        self.metrics.gauge(
+            'server_up', lambda: 0 if self.pool.is_paused(route_name) else 1,
+            route=route_name)
+
+        if self.exporter:
+            self.exporter.start()
 
-    def save_processed_file(self, file_path):
-        """Salva arquivo na lista de processados"""
+    def load_processed_files(self):
+        """Abre o banco de estado (se não foi injetado) e migra a lista
+        antiga na primeira execução"""
+        if self.store is None:
+            self.store = open_state_store(self.log_message)
+
+    def save_processed_file(self, file_path, checksum, size, mtime_ns,
+                            state='done'):
+        """Registra o arquivo como processado no banco de estado"""
         try:
-            self.processed_files.add(file_path)
-            processed_file = os.path.join(
-                os.path.dirname(__file__), 'processed_files.txt')
-            with open(processed_file, 'a', encoding='utf-8') as f:
-                f.write(file_path + '\n')
+            self.store.set_state(file_path, state, checksum=checksum,
+                                 size=size, mtime_ns=mtime_ns, error=None)
         except Exception as e:
             self.log_message(
                 f"⚠️ Erro ao salvar na lista de processados: {str(e)}")
 
     def is_file_processed(self, file_path):
-        """Verifica se arquivo já foi processado"""
-        return file_path in self.processed_files
+        """Verifica se arquivo já foi processado (sem recalcular o hash)"""
+        try:
+            st = os.stat(file_path)
+        except OSError:
+            return False
+        return self.store.is_processed(file_path, st.st_size, st.st_mtime_ns)
+
+    def find_duplicate(self, file_path, checksum):
+        """Retorna a origem do duplicado (índice local ou servidor) ou None"""
+        original = self.store.find_by_checksum(checksum)
+        if original is not None:
+            return original
+        if self.check_server_duplicates and self.exists_on_server(checksum):
+            return 'servidor Paperless'
+        return None
+
+    def exists_on_server(self, checksum):
+        """Consulta o Paperless por um documento com o mesmo checksum"""
+        try:
+            response = self.session.get(
+                f'{self.paperless_url}/api/documents/',
+                params={'checksum__iexact': checksum,
+                        'page_size': 1, 'fields': 'id'},
+                timeout=10)
+            if response.status_code == 200:
+                return response.json().get('count', 0) > 0
+        except (requests.exceptions.RequestException, ValueError) as e:
+            self.log_message(
+                f"⚠️ Não foi possível verificar duplicado no servidor: {str(e)}")
+        return False
 
     def is_file_processing(self, file_path):
         """Verifica se arquivo está sendo processado"""
         return file_path in self.processing_files
 
-    def log_message(self, message):
-        """Log message and update GUI if callback provided"""
-        self.logger.info(message)
+    def log_message(self, message, **fields):
+        """Log message and update GUI if callback provided.
+
+        fields (path, size, duration, status, task_id...) vão para o log JSON.
+        """
+        if self.route_name != 'default':
+            message = f"[{self.route_name}] {message}"
+        fields.setdefault('route', self.route_name)
+        self.logger.info(message, extra={'fields': fields})
         if self.log_callback:
-            self.log_callback(
-                f"{datetime.now().strftime('%H:%M:%S')} - {message}")
+            self.log_callback(f"{time.strftime('%H:%M:%S')} - {message}")
+
+    def accepts(self, file_path):
+        """Filtro barato aplicado a cada evento: globs de inclusão/exclusão
+        (temporários, processados/) e o arquivo morto"""
+        return self.matcher.includes(os.path.basename(file_path)) and \
+            not self.is_excluded(file_path)
+
+    def _detected(self, file_path, message):
+        """Primeiro evento de um arquivo: começa o acompanhamento. Eventos
+        seguintes do mesmo arquivo (created/modified repetidos) são
+        absorvidos pelo tracker até ele ficar estável"""
+        if self._draining.is_set():
+            return
+        if self.tracker.touch(file_path):
+            self.metrics.inc('fs_events_total', route=self.route_name,
+                             outcome='coalesced')
+            return
+
+        # Verificar se já foi processado ou está sendo processado
+        if self.is_file_processing(file_path) or self.is_file_processed(file_path):
+            self.metrics.inc('fs_events_total', route=self.route_name,
+                             outcome='processed')
+            self.log_message(
+                f"⏭️ Arquivo já processado, ignorando: {os.path.basename(file_path)}")
+            return
+
+        self.metrics.inc('fs_events_total', route=self.route_name,
+                         outcome='tracked')
+        self.log_message(f"{message}: {os.path.basename(file_path)}")
+        self._detected_at.setdefault(file_path, time.monotonic())
+        self.tracker.track(file_path)
 
     def on_created(self, event):
         if not event.is_directory:
-            file_path = event.src_path
-
-            # Verificar se não é arquivo da pasta processados
-            if 'processados' in file_path:
+            if not self.accepts(event.src_path):
+                self.metrics.inc('fs_events_total', route=self.route_name,
+                                 outcome='ignored')
                 return
+            self._detected(event.src_path, "📄 Novo arquivo detectado")
 
-            # Verificar se já foi processado ou está sendo processado
-            if self.is_file_processed(file_path) or self.is_file_processing(file_path):
-                self.log_message(
-                    f"⏭️ Arquivo já processado, ignorando: {os.path.basename(file_path)}")
-                return
+    def on_modified(self, event):
+        """Nova escrita num arquivo ainda em acompanhamento"""
+        if not event.is_directory and self.tracker.touch(event.src_path):
+            self.metrics.inc('fs_events_total', route=self.route_name,
+                             outcome='coalesced')
 
-            self.log_message(
-                f"📄 Novo arquivo detectado: {os.path.basename(file_path)}")
-            time.sleep(2)
-            self.upload_file(file_path)
+    def on_closed(self, event):
+        """Escritor fechou o arquivo (inotify close-write, quando disponível)"""
+        if not event.is_directory:
+            self.tracker.mark_closed(event.src_path)
+
+    def on_deleted(self, event):
+        if not event.is_directory:
+            self.tracker.discard(event.src_path)
+            self._detected_at.pop(event.src_path, None)
 
     def on_moved(self, event):
-        """Detecta quando um arquivo é movido para a pasta"""
+        """Detecta quando um arquivo é movido para a pasta (ou renomeado do
+        nome temporário para o final)"""
         if not event.is_directory:
             file_path = event.dest_path
-
-            # Verificar se não é arquivo da pasta processados
-            if 'processados' in file_path:
+            if not self.accepts(file_path):
+                self.tracker.discard(event.src_path)
+                self._detected_at.pop(event.src_path, None)
+                self.metrics.inc('fs_events_total', route=self.route_name,
+                                 outcome='ignored')
                 return
 
-            # Verificar se já foi processado ou está sendo processado
-            if self.is_file_processed(file_path) or self.is_file_processing(file_path):
-                self.log_message(
-                    f"⏭️ Arquivo já processado, ignorando: {os.path.basename(file_path)}")
+            # Ainda em escrita com o nome antigo: continua no novo nome
+            if self.tracker.rename(event.src_path, file_path):
+                detected = self._detected_at.pop(event.src_path, None)
+                if detected is not None:
+                    self._detected_at.setdefault(file_path, detected)
+                self.metrics.inc('fs_events_total', route=self.route_name,
+                                 outcome='coalesced')
                 return
+            self._detected(file_path, "📁 Arquivo movido para pasta")
 
+    def _on_stability_timeout(self, file_path):
+        """Arquivo ainda em escrita após o tempo limite: fica 'pending' no
+        banco (retomado no próximo início) e o tracker segue verificando,
+        agora no intervalo máximo, até ele estabilizar"""
+        self._detected_at.pop(file_path, None)
+        try:
+            self.store.set_state(file_path, 'pending')
+        except Exception as e:
+            self.log_message(f"⚠️ Erro ao salvar pendente: {str(e)}")
+        self.log_message(
+            f"⏱️ Arquivo ainda em escrita após o tempo limite, segue em "
+            f"acompanhamento: {os.path.basename(file_path)}")
+
+    def priority_for(self, file_path):
+        """Prioridade da primeira regra [priority:...] que casar (0 se nenhuma)"""
+        if self.priority_rules:
+            relative = self.relative_path(file_path)
+            for rule in self.priority_rules:
+                if rule.matches(relative):
+                    return rule.priority
+        return 0
+
+    def enqueue_file(self, file_path, retry=False, size=None, backlog=False):
+        """Enfileira o arquivo para upload pelo pool de workers. backlog=True
+        para itens da varredura, que cedem a vez aos que chegam ao vivo"""
+        if self._draining.is_set():
+            return False  # Encerrando: o arquivo fica para o próximo início
+        with self._processing_lock:
+            if file_path in self.processing_files:
+                return False
+            self.processing_files.add(file_path)
+
+        now = time.monotonic()
+        detected = self._detected_at.pop(file_path, None)
+        if detected is not None:
+            self.metrics.observe('stability_wait_seconds', now - detected,
+                                 route=self.route_name)
+        if not retry:
+            # Latência medida desde a detecção (ou desde a varredura)
+            self._enqueued_at[file_path] = detected or now
+
+        try:
+            if retry:
+                self.store.update(file_path, state='pending')
+            else:
+                # Arquivo novo (ou reenviado manualmente): zera as tentativas
+                self.store.set_state(file_path, 'pending', attempts=0,
+                                     next_attempt_at=None)
+            # Arquivos de um lote esperam os demais antes de ir ao pool
+            if self.coalescer and self.coalescer.add(
+                    file_path, self.relative_path(file_path)):
+                return True
+            # Bloqueia aqui se a fila estiver cheia (backpressure)
+            job = self.upload_file_async if self.pool.is_async else self.upload_file
+            if size is None:
+                try:
+                    size = os.path.getsize(file_path)
+                except OSError:
+                    size = 0
+            if not self.pool.submit(job, file_path, route=self.route_name,
+                                    size=size,
+                                    priority=self.priority_for(file_path),
+                                    backlog=backlog):
+                # Pool drenando: continua 'pending' e é retomado no próximo início
+                self.processing_files.discard(file_path)
+                return False
+        except Exception:
+            self.processing_files.discard(file_path)
+            raise
+        return True
+
+    def connection_stats(self):
+        """Contadores de reutilização de conexões HTTP"""
+        return session_connection_stats(self.session)
+
+    def record_failure(self, file_path, error, status_code=None,
+                       retry_after=None):
+        """Agenda nova tentativa com backoff ou move para 'dead' (dead letter)"""
+        row = self.store.get(file_path)
+        attempts = (row['attempts'] if row else 0) + 1
+        retryable = status_code is None or status_code in self.RETRYABLE_STATUS
+        name = os.path.basename(file_path)
+
+        if not retryable or attempts >= self.retry_max_attempts:
+            self.store.set_state(file_path, 'dead', attempts=attempts,
+                                 next_attempt_at=None, error=error)
+            self.log_message(
+                f"⛔ Desistindo de {name} após {attempts} tentativa(s): {error}",
+                path=file_path, status='dead')
+            return
+
+        # Backoff exponencial com jitter; Retry-After do servidor tem prioridade
+        delay = min(self.retry_max_delay,
+                    self.retry_base_delay * 2 ** (attempts - 1))
+        delay = random.uniform(delay / 2, delay)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        self.store.schedule_retry(
+            file_path, attempts, time.time() + delay, error)
+        self.retry_scheduler.notify()
+        self.log_message(
+            f"🔁 Nova tentativa de {name} em {delay:.0f}s "
+            f"(tentativa {attempts}/{self.retry_max_attempts})",
+            path=file_path, status='retry')
+
+    def _on_task_result(self, file_path, task):
+        """Resultado da tarefa de consumo (task None = não confirmada a tempo)"""
+        name = os.path.basename(file_path)
+        if task is None:
+            # Sem confirmação não é 'done': nada de arquivar/apagar, e a
+            # próxima varredura reenvia (o Paperless recusa se já consumiu)
+            self.log_message(
+                f"⚠️ Consumo de {name} não confirmado pelo Paperless a tempo; "
+                f"o arquivo fica na pasta", path=file_path, status='timeout')
+            self.store.update(file_path, state='unconfirmed',
+                              error='consumo não confirmado')
+            return
+
+        result = str(task.get('result') or '')
+        task_fields = {'path': file_path, 'status': task.get('status'),
+                       'task_id': task.get('task_id')}
+        if task.get('status') == 'SUCCESS':
+            document_id = task.get('related_document')
+            self.store.update(file_path, state='done', error=None,
+                              document_id=document_id)
+            suffix = f" (documento #{document_id})" if document_id else ""
+            self.log_message(f"📑 Paperless consumiu {name}{suffix}",
+                             document_id=document_id, **task_fields)
+            self.move_processed_file(file_path)
+        elif 'duplicate' in result.lower():
+            self.store.update(file_path, state='duplicate', error=result[:500])
+            self.log_message(f"♻️ Paperless recusou {name}: documento duplicado",
+                             **task_fields)
+            self.move_processed_file(file_path)
+        else:
+            self.log_message(f"❌ Paperless falhou ao consumir {name}: {result[:200]}",
+                             **task_fields)
+            self.record_failure(file_path, f'Consumo falhou: {result[:450]}')
+
+    def _on_server_down(self, result):
+        self.pool.pause(self.route_name)
+        self.log_message(
+            f"🔴 Servidor Paperless indisponível ({result.detail}): uploads "
+            f"pausados, arquivos aguardando na fila", status='down')
+
+    def _on_server_up(self, result):
+        self.pool.resume(self.route_name)
+        self.log_message("🟢 Servidor Paperless de volta: retomando uploads",
+                         status='up')
+
+    def throttle(self, seconds):
+        """Pausa todos os envios deste uploader (servidor pediu para esperar)"""
+        self._throttle_until = max(self._throttle_until,
+                                   time.monotonic() + seconds)
+
+    def _wait_for_throttle(self):
+        remaining = self._throttle_until - time.monotonic()
+        if remaining > 0:
+            time.sleep(remaining)
+
+    @property
+    def checkpoint_key(self):
+        return f'checkpoint:{os.path.join(self.folder_path, "")}'
+
+    def stop_accepting(self):
+        """Primeira etapa do encerramento: nada novo entra no pool. Arquivos
+        ainda em escrita ficam 'pending' no banco para o próximo início;
+        lotes abertos também (cada arquivo já está como 'pending')"""
+        self._draining.set()
+        for file_path in self.tracker.pending_paths():
+            try:
+                self.store.set_state(file_path, 'pending')
+            except Exception as e:
+                self.log_message(f"⚠️ Erro ao salvar pendente: {str(e)}")
+        self.tracker.stop()
+        if self.coalescer:
+            self.coalescer.stop(flush=False)
+        self.retry_scheduler.stop()
+
+    def checkpoint(self):
+        """Grava o ponto de retomada: instante da parada e as pastas que uma
+        varredura interrompida ainda não listou (os arquivos da fila já
+        estão no banco como 'pending')"""
+        scan_dirs = self._scan_remaining()
+        pending = len(self.store.pending_paths(os.path.join(self.folder_path, '')))
+        self.store.set_meta(self.checkpoint_key, json.dumps(
+            {'stopped_at': time.time(), 'scan_dirs': scan_dirs,
+             'pending': pending}))
+        return pending
+
+    def drain(self, timeout=None):
+        """Encerramento gracioso com prazo (shutdown_timeout): para de aceitar
+        trabalho, deixa os uploads em andamento terminarem e grava o
+        checkpoint. Retorna True se tudo terminou dentro do prazo"""
+        if timeout is None:
+            timeout = self.shutdown_timeout
+        self.stop_accepting()
+        finished = True
+        if self.owns_pool:
+            if self.pool.in_flight(self.route_name):
+                self.log_message(
+                    f"⏳ Aguardando {self.pool.in_flight(self.route_name)} "
+                    f"upload(s) em andamento (até {timeout:.0f}s)...")
+            finished = self.pool.drain(timeout)
+        pending = self.checkpoint()
+        if not finished:
             self.log_message(
-                f"📁 Arquivo movido para pasta: {os.path.basename(file_path)}")
-            time.sleep(2)
-            self.upload_file(file_path)
+                "⚠️ Prazo de encerramento esgotado: uploads interrompidos "
+                "serão retomados no próximo início")
+        if pending:
+            self.log_message(
+                f"💾 {pending} arquivo(s) pendente(s) salvos para o próximo início")
+        self.shutdown(wait=finished)
+        return finished
+
+    def load_checkpoint(self):
+        """Checkpoint da parada anterior (consumido: só vale uma vez), ou None
+        se o processo não foi encerrado de forma limpa"""
+        value = self.store.get_meta(self.checkpoint_key)
+        if value is None:
+            return None
+        self.store.delete_meta(self.checkpoint_key)
+        try:
+            return json.loads(value)
+        except ValueError:
+            return None
+
+    def resume(self, checkpoint=None):
+        """Retoma o trabalho interrompido: os arquivos 'pending' voltam ao
+        acompanhamento de estabilidade (podem ser os que ainda estavam em
+        escrita, e a cópia pode continuar após um reinício rápido) e, com
+        checkpoint, continua a varredura que o encerramento interrompeu.
+        Os 'retry' ficam com o agendador de novas tentativas. Arquivos que
+        chegaram com o programa parado não são deduzidos daqui (timestamps
+        não bastam: um arquivo movido no mesmo volume mantém as datas);
+        ficam para a varredura normal. Retorna quantos arquivos foram
+        retomados"""
+        count = 0
+        for file_path in self.store.pending_paths(
+                os.path.join(self.folder_path, '')):
+            if self._draining.is_set():
+                return count
+            if self.is_file_processing(file_path):
+                continue
+            self._detected_at.setdefault(file_path, time.monotonic())
+            self.tracker.track(file_path)
+            count += 1
+        if checkpoint and checkpoint.get('scan_dirs'):
+            count += self.scan_existing(
+                self.iter_existing_files(dirs=checkpoint['scan_dirs']))
+        return count
+
+    def shutdown(self, wait=True):
+        """Encerra o pool de upload, se pertencer a este uploader"""
+        self.tracker.stop()
+        if self.coalescer:
+            # Lotes ainda abertos seguem para o pool antes de encerrá-lo
+            self.coalescer.stop(flush=wait)
+        self.retry_scheduler.stop()
+        if self.task_poller:
+            self.task_poller.stop()
+        if self.health_monitor:
+            self.health_monitor.stop()
+        if self.archive_sweeper:
+            self.archive_sweeper.stop()
+        if self.owns_pool:
+            self.pool.stop(wait=wait)
+        if self.coalescer and wait:
+            self.coalescer.shutdown()
+
+        if self.exporter:
+            self.exporter.stop()
+
+        if self.optimizer and self.owns_optimizer:
+            if wait:
+                self.optimizer.shutdown()
+            if self.optimizer.stats['files']:
+                self.log_message(self.optimizer.summary())
+
+        stats = self.connection_stats()
+        if stats['requests']:
+            self.log_message(
+                f"🔌 Conexões HTTP: {stats['requests']} requisições, "
+                f"{stats['connections']} conexões abertas, "
+                f"{stats['reused']} reutilizadas")
+        if wait:
+            self.session.close()
+            if self.owns_store:
+                self.store.close()
+
+    def is_excluded(self, file_path):
+        """Caminhos que nunca são enviados (processados/, globs de exclusão e
+        o arquivo morto); vale também para pastas"""
+        for prefix in self._folder_prefixes:
+            if file_path.startswith(prefix):
+                relative = file_path[len(prefix):]
+                break
+        else:
+            relative = os.path.basename(file_path)
+        if os.sep != '/':
+            relative = relative.replace(os.sep, '/')
+        return self.matcher.excludes(relative) or self.archive.contains(file_path)
+
+    def iter_existing_files(self, folder=None, dirs=None):
+        """Percorre a pasta recursivamente com os.scandir, gerando os arquivos
+        ainda não enviados à medida que são encontrados. dirs retoma uma
+        varredura interrompida (pastas ainda não listadas)"""
+        # Posição desta varredura, para o checkpoint. Some quando o gerador
+        # termina ou é descartado (ex.: usuário recusou o envio); se for
+        # interrompido pelo encerramento, as pastas restantes ficam guardadas
+        scan = {'dirs': list(dirs) if dirs else [folder or self.folder_path],
+                'current': None}
+        with self._scan_lock:
+            self._scans[id(scan)] = scan
+        try:
+            yield from self._walk_existing(scan)
+        finally:
+            with self._scan_lock:
+                del self._scans[id(scan)]
+                if self._draining.is_set():
+                    self._interrupted_dirs.extend(self._scan_dirs(scan))
+
+    def _walk_existing(self, scan):
+        pending_dirs = scan['dirs']
+        while pending_dirs:
+            directory = pending_dirs.pop()
+            scan['current'] = directory
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        if self.is_excluded(entry.path):
+                            continue
+                        if entry.is_dir(follow_symlinks=False):
+                            pending_dirs.append(entry.path)
+                            continue
+                        if not entry.is_file() or \
+                                not self.is_valid_document(entry.name):
+                            continue
+                        # DirEntry.stat() reaproveita o resultado da listagem
+                        st = entry.stat()
+                        if st.st_size == 0 or self.is_file_processing(entry.path):
+                            continue
+                        row = self.store.get(entry.path)
+                        if row is not None and row['state'] == 'retry':
+                            continue  # O agendador de retries cuida dele
+                        if self.store.row_is_processed(
+                                row, st.st_size, st.st_mtime_ns):
+                            continue
+                        yield entry.path, st
+            except OSError as e:
+                self.log_message(
+                    f"⚠️ Não foi possível listar {directory}: {str(e)}")
+        scan['current'] = None
+
+    @staticmethod
+    def _scan_dirs(scan):
+        """Pastas que a varredura ainda não terminou de listar"""
+        dirs = list(scan['dirs'])
+        if scan['current']:
+            dirs.append(scan['current'])
+        return dirs
+
+    def _scan_remaining(self):
+        """Pastas ainda não listadas por todas as varreduras interrompidas
+        ou em andamento (ou None)"""
+        with self._scan_lock:
+            dirs = list(self._interrupted_dirs)
+            for scan in self._scans.values():
+                dirs.extend(self._scan_dirs(scan))
+        return list(dict.fromkeys(dirs)) or None
+
+    def scan_existing(self, files=None):
+        """Envia ao pipeline de upload os arquivos já existentes na pasta"""
+        count = 0
+        for file_path, st in files or self.iter_existing_files():
+            if self._draining.is_set():
+                # Encerrando: o checkpoint guarda onde a varredura parou
+                break
+            if time.time() - st.st_mtime < self.tracker.min_quiet:
+                # Modificado agora há pouco: pode ainda estar sendo copiado
+                self._detected_at.setdefault(file_path, time.monotonic())
+                self.tracker.track(file_path)
+            else:
+                self.enqueue_file(file_path, size=st.st_size, backlog=True)
+            count += 1
+        return count
 
     def is_valid_document(self, file_path):
         """Verifica se o arquivo é um documento válido para o Paperless"""
-        valid_extensions = {'.pdf', '.png', '.jpg',
-                            '.jpeg', '.tiff', '.tif', '.txt', '.doc', '.docx'}
-        file_extension = Path(file_path).suffix.lower()
-        return file_extension in valid_extensions
+        return self.matcher.includes(os.path.basename(file_path))
 
     def upload_file(self, file_path):
         """Upload do arquivo para o Paperless"""
         try:
-            # Verificar novamente se já foi processado (dupla verificação)
-            if self.is_file_processed(file_path):
-                self.log_message(
-                    f"⏭️ Arquivo já foi processado anteriormente: {os.path.basename(file_path)}")
+            member = self._prepare_upload(file_path)
+            if member is None:
+                self._enqueued_at.pop(file_path, None)
                 return
+            _, checksum, file_size, _ = member
 
-            # Marcar como sendo processado
-            self.processing_files.add(file_path)
+            self._wait_for_throttle()
+            self.log_message(
+                f"⬆️ Enviando arquivo: {os.path.basename(file_path)} ({file_size} bytes)")
 
-            if not self.is_valid_document(file_path):
-                self.log_message(
-                    f"🚫 Arquivo ignorado (formato não suportado): {os.path.basename(file_path)}")
-                self.processing_files.discard(file_path)
-                return
+            fields = self.build_metadata_fields(file_path)
+            upload_path = self._optimize(file_path, file_size)
+            try:
+                response = self._post_document(upload_path, fields, file_path)
+            finally:
+                if upload_path != file_path:
+                    self.optimizer.cleanup(upload_path)
 
-            if not os.path.exists(file_path):
-                self.log_message(f"❓ Arquivo não encontrado: {file_path}")
-                self.processing_files.discard(file_path)
-                return
+            self._handle_upload_response(
+                response, [member], fields, os.path.basename(file_path))
 
-            file_size = os.path.getsize(file_path)
-            if file_size == 0:
-                self.log_message(
-                    f"📭 Arquivo vazio ignorado: {os.path.basename(file_path)}")
-                self.processing_files.discard(file_path)
-                return
+            # Remover da lista de processamento
+            self.processing_files.discard(file_path)
 
+        except requests.exceptions.RequestException as e:
             self.log_message(
-                f"⬆️ Enviando arquivo: {os.path.basename(file_path)} ({file_size} bytes)")
+                f"❌ Erro de conexão ao enviar {os.path.basename(file_path)}: {str(e)}",
+                path=file_path, status='error')
+            self._enqueued_at.pop(file_path, None)
+            self.record_failure(file_path, str(e)[:500])
+            if self.health_monitor:
+                self.health_monitor.report_failure()
+            self.processing_files.discard(file_path)
+        except Exception as e:
+            self.log_message(
+                f"❌ Erro inesperado ao processar {os.path.basename(file_path)}: {str(e)}")
+            self._enqueued_at.pop(file_path, None)
+            self.processing_files.discard(file_path)
+
+    def _prepare_upload(self, file_path):
+        """Validações e deduplicação antes do envio.
 
-            with open(file_path, 'rb') as file:
-                files = {'document': (os.path.basename(
-                    file_path), file, 'application/octet-stream')}
+        Retorna (caminho, checksum, tamanho, mtime_ns) ou None quando o
+        arquivo não deve ser enviado (já tratado e retirado do processamento).
+        """
+        # Verificar novamente se já foi processado (dupla verificação)
+        if self.is_file_processed(file_path):
+            self.log_message(
+                f"⏭️ Arquivo já foi processado anteriormente: {os.path.basename(file_path)}")
+            self.processing_files.discard(file_path)
+            return None
 
-                upload_url = f'{self.paperless_url}/api/documents/post_document/'
+        # Marcar como sendo processado
+        self.processing_files.add(file_path)
 
-                response = requests.post(
+        if not self.is_valid_document(file_path):
+            self.log_message(
+                f"🚫 Arquivo ignorado (formato não suportado): {os.path.basename(file_path)}")
+            self.store.set_state(file_path, 'ignored')
+            self.processing_files.discard(file_path)
+            return None
+
+        if not os.path.exists(file_path):
+            self.log_message(f"❓ Arquivo não encontrado: {file_path}")
+            self.store.set_state(file_path, 'ignored')
+            self.processing_files.discard(file_path)
+            return None
+
+        st = os.stat(file_path)
+        file_size = st.st_size
+        if file_size == 0:
+            self.log_message(
+                f"📭 Arquivo vazio ignorado: {os.path.basename(file_path)}")
+            self.store.set_state(file_path, 'ignored')
+            self.processing_files.discard(file_path)
+            return None
+
+        # Deduplicação por conteúdo antes de qualquer I/O de rede
+        checksum = self.store.cached_checksum(
+            file_path, file_size, st.st_mtime_ns)
+        if checksum is None:
+            started = time.perf_counter()
+            checksum = self.store.checksum_for(
+                file_path, file_size, st.st_mtime_ns)
+            self.metrics.observe('hash_seconds', time.perf_counter() - started,
+                                 route=self.route_name)
+        duplicate_of = self.find_duplicate(file_path, checksum)
+        if duplicate_of is not None:
+            self.log_message(
+                f"♻️ Conteúdo idêntico já enviado ({duplicate_of}), "
+                f"ignorando: {os.path.basename(file_path)}",
+                path=file_path, size=file_size, status='duplicate')
+            self.save_processed_file(
+                file_path, checksum, file_size, st.st_mtime_ns,
+                state='duplicate')
+            self.move_processed_file(file_path)
+            self.processing_files.discard(file_path)
+            return None
+
+        return file_path, checksum, file_size, st.st_mtime_ns
+
+    def _post_document(self, upload_path, fields, progress_path):
+        """Envia um arquivo ao post_document em streaming"""
+        progress = self._progress_reporter(progress_path)
+        started = time.perf_counter()
+        status = 'error'
+        with MultipartStream(upload_path, os.path.basename(upload_path),
+                             fields=fields, limiter=self.limiter,
+                             progress=progress) as body:
+            upload_url = f'{self.paperless_url}/api/documents/post_document/'
+
+            try:
+                response = self.session.post(
                     upload_url,
-                    files=files,
-                    headers=self.headers,
+                    data=body,
+                    headers={'Content-Type': body.content_type},
                     timeout=60
                 )
+                status = response.status_code
+            finally:
+                self._record_post(started, status, len(body))
+                self._progress_done(progress_path, body.file_size)
+        return response
+
+    def _record_post(self, started, status, size):
+        """Métricas de uma requisição post_document (status 'error' = sem resposta)"""
+        if status != 'error':
+            self.metrics.inc('bytes_sent_total', size, route=self.route_name)
+        self.metrics.observe('http_upload_seconds',
+                             time.perf_counter() - started,
+                             route=self.route_name)
+        self.metrics.inc('uploads_total', route=self.route_name, status=status)
+
+    async def upload_file_async(self, file_path):
+        """upload_file para o engine async: a requisição e a leitura do
+        arquivo não ocupam uma thread; SQLite, hash e otimização vão para o
+        executor padrão"""
+        loop = asyncio.get_running_loop()
+        name = os.path.basename(file_path)
+        try:
+            member = await loop.run_in_executor(
+                None, self._prepare_upload, file_path)
+            if member is None:
+                self._enqueued_at.pop(file_path, None)
+                return
+            _, checksum, file_size, _ = member
+
+            remaining = self._throttle_until - time.monotonic()
+            if remaining > 0:
+                await asyncio.sleep(remaining)
+            self.log_message(f"⬆️ Enviando arquivo: {name} ({file_size} bytes)")
+
+            fields = await loop.run_in_executor(
+                None, self.build_metadata_fields, file_path)
+            upload_path = await loop.run_in_executor(
+                None, self._optimize, file_path, file_size)
+            try:
+                response = await self._post_document_async(
+                    upload_path, fields, file_path)
+            finally:
+                if upload_path != file_path:
+                    self.optimizer.cleanup(upload_path)
+
+            await loop.run_in_executor(
+                None, self._handle_upload_response, response, [member],
+                fields, name)
+            self.processing_files.discard(file_path)
 
-            if response.status_code == 200:
-                self.log_message(
-                    f"✅ Arquivo enviado com sucesso: {os.path.basename(file_path)}")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            error = str(e) or type(e).__name__
+            self.log_message(f"❌ Erro de conexão ao enviar {name}: {error}",
+                             path=file_path, status='error')
+            self._enqueued_at.pop(file_path, None)
+            await loop.run_in_executor(
+                None, self.record_failure, file_path, error[:500])
+            if self.health_monitor:
+                self.health_monitor.report_failure()
+            self.processing_files.discard(file_path)
+        except Exception as e:
+            self.log_message(f"❌ Erro inesperado ao processar {name}: {str(e)}")
+            self._enqueued_at.pop(file_path, None)
+            self.processing_files.discard(file_path)
 
-                # Marcar como processado ANTES de mover
-                self.save_processed_file(file_path)
+    async def _post_document_async(self, upload_path, fields, progress_path):
+        """_post_document com aiohttp. Só a leitura do disco vai para o
+        executor; limite de banda e progresso ficam na corrotina, sem
+        prender threads do executor dormindo"""
+        loop = asyncio.get_running_loop()
+        session = self.pool.session_for(
+            self.paperless_url, self.headers, self.http_pool_size)
+        progress = self._progress_reporter(progress_path)
+        started = time.perf_counter()
+        status = 'error'
+        with MultipartStream(upload_path, os.path.basename(upload_path),
+                             fields=fields) as body:
+            async def chunks():
+                while True:
+                    sent = body.file_sent
+                    chunk = await loop.run_in_executor(
+                        None, body.read, 256 * 1024)
+                    if not chunk:
+                        return
+                    read = body.file_sent - sent
+                    if read:
+                        if self.limiter:
+                            wait = self.limiter.reserve(read)
+                            if wait > 0:
+                                await asyncio.sleep(wait)
+                        progress(body.file_sent, body.file_size)
+                    yield chunk
+
+            try:
+                async with session.post(
+                        f'{self.paperless_url}/api/documents/post_document/',
+                        data=chunks(),
+                        headers={'Content-Type': body.content_type,
+                                 'Content-Length': str(len(body))},
+                        timeout=aiohttp.ClientTimeout(
+                            sock_connect=60, sock_read=60)) as resp:
+                    text = await resp.text()
+                    status = resp.status
+                    response = AsyncResponse(
+                        resp.status, text, resp.headers,
+                        timedelta(seconds=time.perf_counter() - started))
+            finally:
+                self._record_post(started, status, len(body))
+                self._progress_done(progress_path, body.file_size)
+        return response
+
+    def _handle_upload_response(self, response, members, fields, label):
+        """Atualiza o estado dos arquivos de origem conforme a resposta.
+
+        members: [(caminho, checksum, tamanho, mtime_ns)]; um lote tem vários
+        arquivos para um único documento (e uma única tarefa de consumo).
+        """
+        now = time.monotonic()
+        for member in members:
+            started = self._enqueued_at.pop(member[0], None)
+            if started is not None:
+                self.metrics.observe('detect_to_upload_seconds', now - started,
+                                     route=self.route_name)
+
+        log_fields = {
+            'path': members[0][0] if len(members) == 1 else label,
+            'size': sum(member[2] for member in members),
+            'duration': round(response.elapsed.total_seconds(), 3),
+            'status': response.status_code}
+        if len(members) > 1:
+            log_fields['files'] = [member[0] for member in members]
+
+        if response.status_code == 200:
+            task_id = self._parse_task_id(response)
+            self.log_message(f"✅ Arquivo enviado com sucesso: {label}",
+                             task_id=task_id, **log_fields)
+
+            for file_path, checksum, file_size, mtime_ns in members:
+                if self.task_poller and task_id:
+                    # Concluído (e movido) só quando o consumo terminar
+                    self.save_processed_file(
+                        file_path, checksum, file_size, mtime_ns,
+                        state='consuming')
+                    self.store.update(file_path, task_id=task_id)
+                else:
+                    # Marcar como processado ANTES de mover
+                    self.save_processed_file(
+                        file_path, checksum, file_size, mtime_ns)
+
+                    # Mover arquivo
+                    self.move_processed_file(file_path)
+            if self.task_poller and task_id:
+                self.task_poller.notify()
+            return
+
+        self.log_message(
+            f"❌ Erro ao enviar {label}: HTTP {response.status_code}",
+            **log_fields)
+        if response.text:
+            self.log_message(
+                f"Detalhes do erro: {response.text[:200]}")
+
+        if response.status_code >= 500 and self.health_monitor:
+            self.health_monitor.report_failure()
+
+        retry_after = None
+        status_code = response.status_code
+        if status_code == 400 and fields and self._rejected_lookup(
+                response.text):
+            # ID em cache não existe mais: recarregar e tentar de novo
+            status_code = None
+        if response.status_code in self.THROTTLE_STATUS:
+            retry_after = parse_retry_after(
+                response.headers.get('Retry-After'))
+            self.throttle(retry_after if retry_after is not None
+                          else self.retry_base_delay)
+        for member in members:
+            self.record_failure(
+                member[0], f'HTTP {response.status_code}',
+                status_code=status_code, retry_after=retry_after)
+
+    def _submit_batch(self, name, paths):
+        """Lote fechado pelo BatchCoalescer: enfileira no pool de upload"""
+        size = 0
+        for file_path in paths:
+            try:
+                size += os.path.getsize(file_path)
+            except OSError:
+                pass
+        try:
+            if not self.pool.submit(self.upload_batch, paths, name,
+                                    route=self.route_name, size=size,
+                                    priority=self.priority_for(paths[0])):
+                # Pool drenando: os arquivos continuam 'pending' e o lote é
+                # remontado no próximo início
+                for file_path in paths:
+                    self.processing_files.discard(file_path)
+                    self._enqueued_at.pop(file_path, None)
+        except Exception:
+            for file_path in paths:
+                self.processing_files.discard(file_path)
+            raise
 
-                # Mover arquivo
-                self.move_processed_file(file_path)
-            else:
-                self.log_message(
-                    f"❌ Erro ao enviar {os.path.basename(file_path)}: HTTP {response.status_code}")
-                if response.text:
+    def upload_batch(self, paths, name):
+        """Junta os arquivos do lote num único PDF e envia como um documento"""
+        members = []
+        try:
+            for file_path in sorted(paths, key=natural_sort_key):
+                member = self._prepare_upload(file_path)
+                if member is not None:
+                    members.append(member)
+                else:
+                    self._enqueued_at.pop(file_path, None)
+            if not members:
+                return
+
+            member_paths = [member[0] for member in members]
+            if len(members) == 1 or not self.coalescer.can_merge(member_paths):
+                if len(members) > 1:
                     self.log_message(
-                        f"Detalhes do erro: {response.text[:200]}")
+                        f"⚠️ Lote {name} exige Pillow/pypdf para juntar PDFs; "
+                        f"enviando arquivo a arquivo")
+                for file_path in member_paths:
+                    self.upload_file(file_path)
+                return
 
-            # Remover da lista de processamento
-            self.processing_files.discard(file_path)
+            self._wait_for_throttle()
+            try:
+                merged = self.coalescer.merge(member_paths, name)
+            except Exception as e:
+                self.log_message(
+                    f"⚠️ Falha ao juntar o lote {name}, enviando arquivo a "
+                    f"arquivo: {str(e)}")
+                for file_path in member_paths:
+                    self.upload_file(file_path)
+                return
+
+            self.log_message(
+                f"📚 Lote {name}: {len(members)} arquivos -> 1 documento "
+                f"({os.path.getsize(merged)} bytes)")
+            fields = self.build_metadata_fields(member_paths[0])
+            try:
+                response = self._post_document(merged, fields, merged)
+            finally:
+                self.coalescer.cleanup(merged)
+
+            self._handle_upload_response(
+                response, members, fields, os.path.basename(merged))
 
         except requests.exceptions.RequestException as e:
             self.log_message(
-                f"❌ Erro de conexão ao enviar {os.path.basename(file_path)}: {str(e)}")
-            self.processing_files.discard(file_path)
+                f"❌ Erro de conexão ao enviar o lote {name}: {str(e)}")
+            for member in members:
+                self.record_failure(member[0], str(e)[:500])
+            if self.health_monitor:
+                self.health_monitor.report_failure()
         except Exception as e:
             self.log_message(
-                f"❌ Erro inesperado ao processar {os.path.basename(file_path)}: {str(e)}")
-            self.processing_files.discard(file_path)
+                f"❌ Erro inesperado ao processar o lote {name}: {str(e)}")
+        finally:
+            for file_path in paths:
+                self._enqueued_at.pop(file_path, None)
+                self.processing_files.discard(file_path)
 
-    def move_processed_file(self, file_path):
-        """Move arquivo processado para subpasta"""
+    def _optimize(self, file_path, file_size):
+        """Caminho a enviar: o original ou a versão otimizada temporária"""
+        if self.optimizer is None:
+            return file_path
         try:
-            processed_folder = os.path.join(
-                os.path.dirname(file_path), 'processados')
-            os.makedirs(processed_folder, exist_ok=True)
-
-            filename = os.path.basename(file_path)
-            new_path = os.path.join(processed_folder, filename)
-
-            if os.path.exists(new_path):
-                name, ext = os.path.splitext(filename)
-                timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-                new_path = os.path.join(
-                    processed_folder, f"{name}_{timestamp}{ext}")
-
-            os.rename(file_path, new_path)
+            optimized = self.optimizer.optimize(file_path)
+        except Exception as e:
             self.log_message(
-                f"📂 Arquivo movido para: processados/{os.path.basename(new_path)}")
+                f"⚠️ Falha ao otimizar {os.path.basename(file_path)}, "
+                f"enviando original: {str(e)}")
+            return file_path
+        if optimized is None:
+            return file_path
+        new_size = os.path.getsize(optimized)
+        self.log_message(
+            f"🗜️ {os.path.basename(file_path)} otimizado: "
+            f"{file_size} -> {new_size} bytes ({os.path.basename(optimized)})")
+        return optimized
+
+    def relative_path(self, file_path):
+        """Caminho relativo à pasta monitorada, sempre com '/'"""
+        return os.path.relpath(file_path, self.folder_path).replace(os.sep, '/')
+
+    def build_metadata_fields(self, file_path):
+        """Campos extras do post_document segundo as regras de metadados"""
+        if not self.metadata_rules:
+            return []
+        relative = self.relative_path(file_path)
+        metadata = {}
+        for rule in self.metadata_rules:
+            rule.apply(relative, metadata)
+
+        fields = []
+        for field in ('title', 'created'):
+            if field in metadata:
+                fields.append((field, metadata[field]))
+        lookups = [('correspondent', 'correspondents', metadata.get('correspondent')),
+                   ('document_type', 'document_types', metadata.get('document_type'))]
+        lookups += [('tags', 'tags', tag) for tag in metadata.get('tags', [])]
+        for field, kind, name in lookups:
+            if not name:
+                continue
+            try:
+                object_id = self.lookups.resolve(kind, name)
+            except (requests.exceptions.RequestException, ValueError) as e:
+                self.log_message(f"⚠️ Não foi possível consultar {kind}: {str(e)}")
+                continue
+            if object_id is None:
+                self.log_message(
+                    f"⚠️ '{name}' não existe em {kind} no Paperless; ignorado")
+            else:
+                fields.append((field, object_id))
+        return fields
+
+    def _rejected_lookup(self, response_text):
+        """400 citando um campo de metadados: invalida o cache desse tipo"""
+        rejected = False
+        for field, kind in (('correspondent', 'correspondents'),
+                            ('document_type', 'document_types'),
+                            ('tags', 'tags')):
+            if f'"{field}"' in response_text:
+                self.lookups.invalidate(kind)
+                rejected = True
+        return rejected
+
+    def _progress_reporter(self, file_path):
+        """Cria o callback de progresso de um upload (eventos + log a cada 25%)"""
+        name = os.path.basename(file_path)
+        next_mark = [25]
+
+        def report(sent, total):
+            if self.progress_callback:
+                self.progress_callback(file_path, sent, total)
+            if total >= self.progress_log_min_size:
+                percent = sent * 100 // total
+                if percent >= next_mark[0] and percent < 100:
+                    self.log_message(f"📶 {name}: {percent}% enviado")
+                    next_mark[0] = (percent // 25 + 1) * 25
+
+        return report
+
+    def _progress_done(self, file_path, total):
+        """Fecha o progresso do upload, inclusive quando falhou no meio, para
+        a interface não manter a entrada"""
+        if self.progress_callback:
+            self.progress_callback(file_path, total, total)
+
+    @staticmethod
+    def _parse_task_id(response):
+        """post_document responde com o UUID da tarefa de consumo (string JSON)"""
+        try:
+            task_id = response.json()
+        except ValueError:
+            return None
+        if isinstance(task_id, str) and len(task_id) == 36:
+            return task_id
+        return None
+
+    def move_processed_file(self, file_path):
+        """Arquiva o arquivo processado conforme a política (archive_mode)"""
+        try:
+            new_path = self.archive.archive(file_path)
+            if new_path is None:
+                self.log_message(
+                    f"🗑️ Arquivo removido após o envio: {os.path.basename(file_path)}")
+                return
 
-            # Atualizar o caminho na lista de processados
-            self.processed_files.discard(file_path)  # Remove caminho antigo
-            self.save_processed_file(new_path)  # Adiciona novo caminho
+            if self.archive.archive_dir is None:
+                shown = os.path.relpath(new_path, os.path.dirname(file_path))
+            else:
+                shown = new_path
+            verb = {'hardlink': 'arquivado (hardlink) em',
+                    'zip': 'compactado em'}.get(self.archive.mode, 'movido para')
+            self.log_message(f"📂 Arquivo {verb}: {shown}", path=file_path)
+            self.store.update(file_path, archived_path=new_path,
+                              archived_at=time.time())
 
         except Exception as e:
             self.log_message(f"⚠️ Não foi possível mover o arquivo: {str(e)}")
@@ -237,21 +3990,34 @@ class PaperlessUploader(FileSystemEventHandler):
 
 
 class PaperlessMonitorGUI:
-    def __init__(self):
+    LOG_FLUSH_INTERVAL_MS = 100  # Intervalo de inserção em lote no log
+    LOG_BATCH_LIMIT = 500  # Máximo de mensagens inseridas por ciclo
+
+    def __init__(self, config_file='config.ini'):
+        _load_gui_modules()
         self.root = tk.Tk()
         self.root.title("Paperless Auto Uploader - Configuração")
         self.root.geometry("650x600")
         self.root.resizable(True, True)
 
         self.observer = None
+        self.monitoring = False  # Observer agendado no uploader atual
+        self.drain_thread = None  # Encerramento gracioso em andamento
         self.config = ConfigParser()
-        self.config_file = 'config.ini'
+        self.config_file = config_file
         self.is_background_mode = False
         self.tray_icon = None
+        # Mensagens de log vindas de qualquer thread; só o loop do Tk as insere
+        self.log_queue = queue.SimpleQueue()
+        # Progresso dos uploads em andamento (atualizado pelos workers)
+        self.upload_progress = {}
 
         self.load_config()
+        self.log_max_lines = self.config['DEFAULT'].getint(
+            'gui_log_max_lines', fallback=1000)
         self.create_widgets()
         self.load_saved_config()
+        self.root.after(self.LOG_FLUSH_INTERVAL_MS, self._flush_log_queue)
 
     def create_widgets(self):
         # Frame principal
@@ -365,6 +4131,10 @@ class PaperlessMonitorGUI:
                                  font=('TkDefaultFont', 10, 'bold'))
         status_label.pack()
 
+        self.progress_var = tk.StringVar(value="")
+        progress_label = ttk.Label(status_frame, textvariable=self.progress_var)
+        progress_label.pack()
+
         # Log
         log_frame = ttk.LabelFrame(
             main_frame, text="Log de Atividades", padding="10")
@@ -397,11 +4167,97 @@ class PaperlessMonitorGUI:
             self.folder_var.set(folder)
 
     def log_to_gui(self, message):
-        """Adiciona mensagem ao log da GUI"""
-        if self.log_text:
-            self.log_text.insert(tk.END, message + "\n")
+        """Adiciona mensagem ao log da GUI (seguro para chamar de qualquer thread)"""
+        self.log_queue.put(message)
+
+    def _flush_log_queue(self):
+        """Insere as mensagens pendentes em lote e limita o histórico do log"""
+        lines = []
+        try:
+            while len(lines) < self.LOG_BATCH_LIMIT:
+                lines.append(self.log_queue.get_nowait())
+        except queue.Empty:
+            pass
+
+        if lines:
+            self.log_text.insert(tk.END, "\n".join(lines) + "\n")
+            # 'end-1c' fica na linha vazia após a última quebra de linha
+            total_lines = int(self.log_text.index('end-1c').split('.')[0]) - 1
+            excess = total_lines - self.log_max_lines
+            if excess > 0:
+                self.log_text.delete('1.0', f'{excess + 1}.0')
             self.log_text.see(tk.END)
-            self.root.update_idletasks()
+
+        self._render_progress()
+        self.root.after(self.LOG_FLUSH_INTERVAL_MS, self._flush_log_queue)
+
+    def _on_upload_progress(self, file_path, sent, total):
+        """Chamado pelos workers; apenas registra, o Tk renderiza no próximo ciclo"""
+        if sent >= total:
+            self.upload_progress.pop(file_path, None)
+        else:
+            self.upload_progress[file_path] = (sent, total)
+
+    def _render_progress(self):
+        items = list(self.upload_progress.items())[:3]
+        text = "   ".join(
+            f"⬆️ {os.path.basename(path)} {sent * 100 // total}%"
+            for path, (sent, total) in items)
+        if self.progress_var.get() != text:
+            self.progress_var.set(text)
+
+    def _create_uploader(self, url, token, folder):
+        uploader = PaperlessUploader(
+            url, token, folder, self.log_to_gui,
+            settings=self.config['DEFAULT'])
+        uploader.progress_callback = self._on_upload_progress
+        return uploader
+
+    def _uploader_matches(self, url, token, folder):
+        uploader = getattr(self, 'uploader', None)
+        return uploader is not None and \
+            uploader.paperless_url == url.rstrip('/') and \
+            uploader.api_token == token and uploader.folder_path == folder
+
+    def _with_uploader(self, url, token, folder, action):
+        """Executa action() com self.uploader do servidor e pasta informados.
+        Reaproveita o atual (ex.: criado por "Processar Arquivos Existentes")
+        se coincidir; senão encerra o antigo em segundo plano e só cria o
+        novo quando o drain terminar (pool, agendador e porta de métricas
+        liberados), sem travar a janela"""
+        if self._uploader_matches(url, token, folder):
+            action()
+            return
+        self._retire_uploader()
+
+        def create():
+            try:
+                self.uploader = self._create_uploader(url, token, folder)
+            except Exception as e:
+                self.start_button.config(state=tk.NORMAL)
+                self.log_to_gui(f"❌ Erro ao criar o uploader: {str(e)}")
+                return
+            action()
+
+        self._after_drain(create)
+
+    def _after_drain(self, callback, announced=False):
+        """Chama callback no loop do Tk quando o encerramento anterior acabar"""
+        if self.drain_thread is not None and self.drain_thread.is_alive():
+            if not announced:
+                self.log_to_gui("⏳ Aguardando o encerramento anterior...")
+            self.root.after(200, self._after_drain, callback, True)
+            return
+        callback()
+
+    def _retire_uploader(self):
+        """Encerra o uploader atual em segundo plano (drain com prazo)"""
+        uploader = getattr(self, 'uploader', None)
+        if uploader is not None:
+            del self.uploader
+            self.drain_thread = threading.Thread(
+                target=uploader.drain, name='drain', daemon=True)
+            self.drain_thread.start()
 
     def test_connection(self):
         """Testa a conexão com o servidor Paperless"""
@@ -415,19 +4271,25 @@ class PaperlessMonitorGUI:
                 return
 
             self.log_to_gui("🔍 Testando conexão...")
-            headers = {'Authorization': f'Token {token}'}
-            response = requests.get(
-                f'{url}/api/documents/', headers=headers, timeout=10)
+            uploader = getattr(self, 'uploader', None)
+            if uploader and uploader.paperless_url == url and \
+                    uploader.api_token == token:
+                # Monitorando: reaproveita a sonda (e o cache) do uploader
+                result = uploader.health.check()
+            else:
+                headers = {'Authorization': f'Token {token}'}
+                with create_session(headers, pool_size=1) as session:
+                    result = HealthChecker(session, url, timeout=10).check()
 
-            if response.status_code == 200:
+            if result.ok:
                 messagebox.showinfo(
                     "✅ Sucesso", "Conexão com o Paperless estabelecida com sucesso!")
                 self.log_to_gui("✅ Teste de conexão bem-sucedido")
             else:
                 messagebox.showerror(
-                    "❌ Erro", f"Falha na conexão: HTTP {response.status_code}")
+                    "❌ Erro", f"Falha na conexão: {result.detail}")
                 self.log_to_gui(
-                    f"❌ Teste de conexão falhou: HTTP {response.status_code}")
+                    f"❌ Teste de conexão falhou: {result.detail}")
 
         except Exception as e:
             messagebox.showerror("❌ Erro", f"Erro ao testar conexão: {str(e)}")
@@ -443,15 +4305,13 @@ class PaperlessMonitorGUI:
             )
 
             if response:
-                # Limpar arquivo de controle
-                processed_file = os.path.join(
-                    os.path.dirname(__file__), 'processed_files.txt')
-                if os.path.exists(processed_file):
-                    os.remove(processed_file)
-
-                # Limpar lista em memória se uploader existe
+                # Limpar banco de estado
                 if hasattr(self, 'uploader'):
-                    self.uploader.processed_files.clear()
+                    self.uploader.store.clear()
+                else:
+                    store = StateStore(app_data_path('paperless_state.db'))
+                    store.clear()
+                    store.close()
 
                 self.log_to_gui("🧹 Lista de arquivos processados foi limpa")
                 messagebox.showinfo(
@@ -478,12 +4338,18 @@ class PaperlessMonitorGUI:
                     "❌ Erro", "A pasta especificada não existe")
                 return
 
-            # Criar uploader temporário se não existir
-            if not hasattr(self, 'uploader'):
-                self.uploader = PaperlessUploader(
-                    url, token, folder, self.log_to_gui)
+            if self.monitoring and \
+                    not self._uploader_matches(url, token, folder):
+                # O observer ativo está agendado no uploader atual
+                messagebox.showwarning(
+                    "Monitoramento Ativo",
+                    "Pare o monitoramento antes de trocar servidor, token "
+                    "ou pasta.")
+                return
 
-            self.process_existing_files(folder)
+            # Criar uploader se não existir (o monitoramento o reaproveita)
+            self._with_uploader(url, token, folder,
+                                lambda: self.process_existing_files(folder))
 
         except Exception as e:
             messagebox.showerror(
@@ -491,43 +4357,37 @@ class PaperlessMonitorGUI:
             self.log_to_gui(f"❌ Erro ao processar arquivos: {str(e)}")
 
     def process_existing_files(self, folder):
-        """Processa arquivos que já existem na pasta"""
+        """Processa arquivos que já existem na pasta (inclusive subpastas)"""
         try:
             self.log_to_gui("📂 Verificando arquivos existentes na pasta...")
 
-            # Buscar arquivos na pasta principal (excluindo pasta processados)
-            files_found = []
-            for file_path in Path(folder).iterdir():
-                if (file_path.is_file() and
-                    self.uploader.is_valid_document(str(file_path)) and
-                    not self.uploader.is_file_processed(str(file_path)) and
-                        'processados' not in str(file_path)):
-                    files_found.append(str(file_path))
-
-            if files_found:
-                self.log_to_gui(
-                    f"📄 Encontrados {len(files_found)} arquivo(s) existente(s)")
+            # Só procura o primeiro candidato; o restante é enviado em fluxo
+            files = self.uploader.iter_existing_files(folder)
+            first = next(files, None)
 
+            if first is not None:
                 # Perguntar se quer processar arquivos existentes
                 response = messagebox.askyesno(
                     "Arquivos Existentes",
-                    f"Encontrei {len(files_found)} arquivo(s) na pasta.\n\n"
+                    "Encontrei arquivos ainda não enviados na pasta.\n\n"
                     "Deseja enviar estes arquivos existentes para o Paperless?\n\n"
                     "• SIM: Envia arquivos existentes + monitora novos\n"
                     "• NÃO: Apenas monitora arquivos novos"
                 )
 
                 if response:
-                    # Processar arquivos existentes em thread separada
+                    # Varredura e envio em thread separada, no ritmo do pool
                     def process_files():
-                        for file_path in files_found:
-                            self.uploader.upload_file(file_path)
-                            time.sleep(1)  # Pausa entre uploads
+                        count = self.uploader.scan_existing(
+                            itertools.chain([first], files))
+                        self.log_to_gui(
+                            f"📄 {count} arquivo(s) existente(s) enviados para a fila")
 
                     process_thread = threading.Thread(
                         target=process_files, daemon=True)
                     process_thread.start()
                 else:
+                    files.close()  # Varredura recusada: não entra no checkpoint
                     self.log_to_gui(
                         "⏭️ Ignorando arquivos existentes, apenas monitorando novos")
             else:
@@ -554,20 +4414,40 @@ class PaperlessMonitorGUI:
                     "❌ Erro", "A pasta especificada não existe")
                 return
 
-            self.uploader = PaperlessUploader(
-                url, token, folder, self.log_to_gui)
+            # Sem novo clique enquanto espera o encerramento anterior
+            self.start_button.config(state=tk.DISABLED)
+            self._with_uploader(url, token, folder,
+                                lambda: self._begin_monitoring(folder))
+
+        except Exception as e:
+            self.start_button.config(state=tk.NORMAL)
+            messagebox.showerror(
+                "❌ Erro", f"Erro ao iniciar monitoramento: {str(e)}")
+            self.log_to_gui(f"❌ Erro ao iniciar: {str(e)}")
+
+    def _begin_monitoring(self, folder):
+        """Segunda etapa do início, já com self.uploader pronto"""
+        try:
+            # Retomar o que ficou pendente (e a varredura interrompida)
+            checkpoint = self.uploader.load_checkpoint()
+            self._resume_in_background(self.uploader, checkpoint)
 
-            # Verificar e processar arquivos existentes primeiro
+            # Verificar e processar arquivos existentes primeiro (inclui os
+            # que chegaram com o programa parado)
             self.process_existing_files(folder)
 
-            # Configurar observer para novos arquivos
-            self.observer = Observer()
+            # Configurar observer para novos arquivos (polling em
+            # compartilhamentos de rede, onde eventos nativos não chegam)
+            self.observer = create_observer(
+                folder, self.config['DEFAULT'], log=self.log_to_gui)
             self.observer.schedule(self.uploader, folder, recursive=True)
+            polling = isinstance(self.observer, IncrementalPollingObserver)
 
             def start_observer():
                 self.observer.start()
                 self.log_to_gui(
-                    f"🔍 Monitoramento de novos arquivos iniciado em: {folder}")
+                    f"🔍 Monitoramento de novos arquivos iniciado em: {folder}"
+                    + (" (polling)" if polling else ""))
                 self.log_to_gui(
                     "💡 Agora qualquer arquivo novo será enviado automaticamente")
                 self.status_var.set("🟢 Monitoramento ATIVO")
@@ -581,6 +4461,7 @@ class PaperlessMonitorGUI:
             self.observer_thread = threading.Thread(
                 target=start_observer, daemon=True)
             self.observer_thread.start()
+            self.monitoring = True
 
             # Atualizar interface
             self.start_button.config(state=tk.DISABLED)
@@ -588,19 +4469,37 @@ class PaperlessMonitorGUI:
             self.background_button.config(state=tk.NORMAL)
 
         except Exception as e:
+            self.start_button.config(state=tk.NORMAL)
             messagebox.showerror(
                 "❌ Erro", f"Erro ao iniciar monitoramento: {str(e)}")
             self.log_to_gui(f"❌ Erro ao iniciar: {str(e)}")
 
+    def _resume_in_background(self, uploader, checkpoint):
+        """Reenfileira os pendentes (e continua do checkpoint) sem travar a
+        interface"""
+        def resume():
+            count = uploader.resume(checkpoint)
+            if count:
+                self.log_to_gui(f"♻️ Retomado do ponto de parada: {count} "
+                                f"arquivo(s) enviados para a fila")
+
+        threading.Thread(target=resume, daemon=True).start()
+
     def stop_monitoring(self):
-        """Para o monitoramento"""
+        """Para o monitoramento. Uploads em andamento terminam (até
+        shutdown_timeout) e a fila fica salva para o próximo início"""
         try:
+            self.monitoring = False
             if self.observer and self.observer.is_alive():
                 self.observer.stop()
                 self.observer.join(timeout=5)
                 self.log_to_gui("🛑 Monitoramento interrompido")
                 self.status_var.set("🔴 Monitoramento PARADO")
 
+            # Encerramento em segundo plano para não travar a janela; um
+            # novo uploader é criado no próximo início
+            self._retire_uploader()
+
             # Atualizar interface
             self.start_button.config(state=tk.NORMAL)
             self.stop_button.config(state=tk.DISABLED)
@@ -612,6 +4511,8 @@ class PaperlessMonitorGUI:
 
     def create_tray_icon(self):
         """Cria ícone na bandeja do sistema"""
+        _load_tray_modules()
+
         # Criar uma imagem simples para o ícone
         image = Image.new('RGB', (64, 64), color='blue')
         draw = ImageDraw.Draw(image)
@@ -676,6 +4577,9 @@ class PaperlessMonitorGUI:
     def quit_app(self):
         """Fecha completamente o aplicativo"""
         self.stop_monitoring()
+        if self.drain_thread is not None:
+            # Espera o encerramento gracioso (limitado por shutdown_timeout)
+            self.drain_thread.join()
         if self.tray_icon:
             self.tray_icon.stop()
         self.root.quit()
@@ -684,11 +4588,12 @@ class PaperlessMonitorGUI:
     def save_config(self):
         """Salva as configurações"""
         try:
-            self.config['DEFAULT'] = {
+            # Atualiza apenas os campos da interface, preservando opções avançadas
+            self.config['DEFAULT'].update({
                 'paperless_url': self.url_var.get(),
                 'api_token': self.token_var.get(),
                 'monitor_folder': self.folder_var.get()
-            }
+            })
 
             with open(self.config_file, 'w') as f:
                 self.config.write(f)
@@ -743,12 +4648,205 @@ class PaperlessMonitorGUI:
         self.root.mainloop()
 
 
-if __name__ == "__main__":
+def load_routes(config):
+    """Rotas (nome, seção) da configuração: cada seção [route:nome] é uma
+    pasta ligada a um servidor; sem nenhuma, usa apenas a seção DEFAULT"""
+    routes = [(section.split(':', 1)[1].strip(), config[section])
+              for section in config.sections() if section.startswith('route:')]
+    return routes or [('default', config['DEFAULT'])]
+
+
+class MonitorService:
+    """Monitora várias pastas com um único observer, pool e banco de estado"""
+
+    def __init__(self, config, log_callback=None):
+        defaults = config['DEFAULT']
+        setup_logging(defaults)
+        self.pool = create_upload_pool(defaults)
+        self.store = open_state_store(logging.getLogger(__name__).info)
+        limit_kb = defaults.getfloat('bandwidth_limit_kb', fallback=0)
+        self.limiter = TokenBucket(limit_kb * 1024) if limit_kb > 0 else None
+        self.optimizer = ImageOptimizer.from_settings(defaults)
+        self.metrics = Metrics()
+        self.exporter = MetricsExporter.from_settings(self.metrics, defaults)
+        self.shutdown_timeout = defaults.getfloat('shutdown_timeout',
+                                                  fallback=30.0)
+        # Um observer nativo compartilhado; rotas em compartilhamentos de
+        # rede ganham cada uma o seu IncrementalPollingObserver
+        self.observers = []
+        self.polling_routes = set()
+        native = None
+        self.uploaders = []
+
+        for name, section in load_routes(config):
+            url = section.get('paperless_url', '').strip()
+            token = section.get('api_token', '').strip()
+            folder = section.get('monitor_folder', '').strip()
+            if not all([url, token, folder]):
+                raise ValueError(
+                    f"Rota '{name}': configure paperless_url, api_token e monitor_folder")
+            if not os.path.isdir(folder):
+                raise ValueError(
+                    f"Rota '{name}': a pasta especificada não existe: {folder}")
+            uploader = PaperlessUploader(
+                url, token, folder, log_callback, settings=section,
+                pool=self.pool, store=self.store, route_name=name,
+                limiter=self.limiter, optimizer=self.optimizer,
+                metrics=self.metrics)
+            self.uploaders.append(uploader)
+            observer = create_observer(folder, section,
+                                       log=uploader.log_message)
+            if isinstance(observer, IncrementalPollingObserver):
+                self.observers.append(observer)
+                self.polling_routes.add(name)
+            else:
+                if native is None:
+                    native = observer
+                    self.observers.append(native)
+                observer = native
+            observer.schedule(uploader, folder, recursive=True)
+
+    def log_message(self, message):
+        if len(self.uploaders) == 1:
+            self.uploaders[0].log_message(message)
+        else:
+            logging.getLogger(__name__).info(message)
+
+    def start(self, scan_existing=False):
+        if self.exporter:
+            self.exporter.start()
+        for observer in self.observers:
+            observer.start()
+        for uploader in self.uploaders:
+            uploader.log_message(
+                f"🔍 Monitoramento iniciado em: {uploader.folder_path} "
+                f"-> {uploader.paperless_url}"
+                + (" (polling)" if uploader.route_name in self.polling_routes
+                   else ""))
+
+        # Retoma o que ficou pendente; a varredura interrompida só é
+        # continuada quando não haverá varredura completa
+        checkpoints = [uploader.load_checkpoint() for uploader in self.uploaders]
+
+        def process_files():
+            for uploader, checkpoint in zip(self.uploaders, checkpoints):
+                count = uploader.resume(None if scan_existing else checkpoint)
+                if count:
+                    uploader.log_message(
+                        f"♻️ Retomado do ponto de parada: {count} arquivo(s) "
+                        f"enviados para a fila")
+                if scan_existing:
+                    count = uploader.scan_existing()
+                    uploader.log_message(
+                        f"📄 {count} arquivo(s) existente(s) enviados para a fila")
+
+        threading.Thread(target=process_files, daemon=True).start()
+
+    def is_alive(self):
+        return all(observer.is_alive() for observer in self.observers)
+
+    def stop(self, timeout=None):
+        """Encerramento gracioso: para de aceitar trabalho, dá aos uploads em
+        andamento até shutdown_timeout segundos e grava o checkpoint de
+        cada pasta para o próximo início"""
+        if timeout is None:
+            timeout = self.shutdown_timeout
+        for observer in self.observers:
+            observer.stop()
+        for observer in self.observers:
+            observer.join(timeout=5)
+        for uploader in self.uploaders:
+            uploader.stop_accepting()
+        in_flight = self.pool.in_flight()
+        if in_flight:
+            self.log_message(f"⏳ Aguardando {in_flight} upload(s) em "
+                             f"andamento (até {timeout:.0f}s)...")
+        finished = self.pool.drain(timeout)
+        if not finished:
+            self.log_message(
+                "⚠️ Prazo de encerramento esgotado: uploads interrompidos "
+                "serão retomados no próximo início")
+        for uploader in self.uploaders:
+            pending = uploader.checkpoint()
+            if pending:
+                uploader.log_message(f"💾 {pending} arquivo(s) pendente(s) "
+                                     f"salvos para o próximo início")
+            uploader.shutdown(wait=False)
+        self.pool.stop(wait=finished)
+        if self.exporter:
+            self.exporter.stop()
+        if not finished:
+            return  # Workers presos num upload ainda usam sessões e banco
+        for uploader in self.uploaders:
+            if uploader.coalescer:
+                uploader.coalescer.shutdown()
+            uploader.session.close()
+        if self.optimizer:
+            self.optimizer.shutdown()
+            if self.optimizer.stats['files']:
+                self.log_message(self.optimizer.summary())
+        self.store.close()
+
+
+def run_headless(config_file, scan_existing=False):
+    """Executa o monitoramento sem interface gráfica (ex.: serviço systemd)"""
+    config = ConfigParser()
+    if not config.read(config_file, encoding='utf-8'):
+        print(f"Arquivo de configuração não encontrado: {config_file}")
+        return 2
+
     try:
-        app = PaperlessMonitorGUI()
+        service = MonitorService(config)
+    except ValueError as e:
+        print(f"Erro na configuração ({config_file}): {e}")
+        return 2
+
+    stop_event = threading.Event()
+
+    def request_stop(signum, frame):
+        stop_event.set()
+
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+
+    service.start(scan_existing=scan_existing)
+    try:
+        while not stop_event.wait(1):
+            if not service.is_alive():
+                service.log_message("❌ Observer encerrado inesperadamente")
+                return 1
+    finally:
+        service.stop()
+        service.log_message("🛑 Monitoramento interrompido")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Envia automaticamente documentos de uma pasta para o Paperless-ngx")
+    parser.add_argument('--headless', action='store_true',
+                        help="executa sem interface gráfica (modo serviço)")
+    parser.add_argument('--config', default='config.ini',
+                        help="arquivo de configuração (padrão: config.ini)")
+    parser.add_argument('--scan-existing', action='store_true',
+                        help="no modo headless, envia também os arquivos já existentes na pasta")
+    args = parser.parse_args(argv)
+
+    if args.headless:
+        return run_headless(args.config, scan_existing=args.scan_existing)
+
+    try:
+        app = PaperlessMonitorGUI(args.config)
         app.run()
     except KeyboardInterrupt:
         print("Programa interrompido pelo usuário")
     except Exception as e:
         print(f"Erro fatal: {e}")
         input("Pressione Enter para sair...")
+    return 0
+
+
+if __name__ == "__main__":
+    # Necessário para o pool de processos no executável gerado pelo PyInstaller
+    multiprocessing.freeze_support()
+    sys.exit(main())